@@ -1,4 +1,16 @@
-import requests, os.path, logging, sys, time
+import requests, os.path, logging, sys, time, datetime, collections, threading, gzip, random, fnmatch, contextlib, contextvars, re, html, functools
+import json as stdlib_json, struct, mmap, hashlib, sqlite3, base64, uuid, io, tempfile, zipfile, csv, codecs
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from concurrent import futures
+numpy = None # imported by the columnar helpers, see import_numpy
+aiohttp = asyncio = None # imported by AsyncMandrill, see import_aiohttp
 try:
     import ujson as json
 except ImportError:
@@ -67,8 +79,27 @@ class MetadataFieldLimitError(Error):
     pass
 class UnknownMetadataFieldError(Error):
     pass
+class UnexpectedResponseError(Error):
+    '''Raised when the API answers with something that is not a JSON document, typically an HTML error page from a proxy'''
+    def __init__(self, message, status_code):
+        super(UnexpectedResponseError, self).__init__(message)
+        self.status_code = status_code
+class CircuitOpenError(Error):
+    '''Raised without calling the API while the circuit breaker of the endpoint family is open'''
+    pass
+class DeadlineExceededError(Error):
+    '''Raised when the deadline of a call is over before it could complete'''
+    pass
+class PartialSendError(Error):
+    '''Raised when some chunks of a chunked send failed: results holds the merged results of the chunks that went through and errors the exceptions raised by the others'''
+    def __init__(self, message, results, errors):
+        super(PartialSendError, self).__init__(message)
+        self.results = results
+        self.errors = errors
 
 ROOT = 'https://mandrillapp.com/api/1.0/'
+HEADERS = {'content-type': 'application/json', 'user-agent': 'Mandrill-Python/1.0.58', 'accept-encoding': 'gzip, deflate'}
+GZIP_HEADERS = dict(HEADERS, **{'content-encoding': 'gzip'})
 ERROR_MAP = {
     'ValidationError': ValidationError,
     'Invalid_Key': InvalidKeyError,
@@ -101,12 +132,734 @@ ERROR_MAP = {
     'Unknown_MetadataField': UnknownMetadataFieldError
 }
 
+class JSONCodec(object):
+    '''Encode params to and decode results from UTF-8 bytes with a json-compatible module (json, simplejson or ujson)'''
+    def __init__(self, module):
+        self.module = module
+
+    def encode(self, obj):
+        return self.module.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        return self.module.loads(data)
+
+class OrjsonCodec(object):
+    '''Encode params to and decode results from bytes with orjson.
+
+    Unlike json, orjson cannot encode integers that do not fit in 64 bits.  Dict keys that are not strings are
+    converted to strings, as json does.
+    '''
+    def encode(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+CODECS = {'json': JSONCodec(stdlib_json), json.__name__: JSONCodec(json)}
+if orjson is not None: CODECS['orjson'] = OrjsonCodec()
+DEFAULT_CODEC = CODECS[json.__name__] # orjson is opt-in, as it does not encode everything json does
+
+class Attachment(object):
+    '''An attachment or inline image read and base64-encoded on the fly while the request is sent.
+
+    Put it in message['attachments'] or message['images'] in place of the usual struct, and the request body is
+    streamed to the API instead of holding the whole base64 content in memory::
+
+        message['attachments'] = [mandrill.Attachment('/path/to/report.pdf', type='application/pdf')]
+
+    Args:
+       source (str|bytes|file): a file path, a bytes-like object such as an mmap, or a binary file object positioned at the start of the content
+       name (str|None): the file name of the attachment, defaults to the base name of a path source
+       type (str): the MIME type of the attachment
+    '''
+    CHUNK_SIZE = 3 * 64 * 1024 # a multiple of 3 so that chunks encode without padding
+
+    def __init__(self, source, name=None, type='application/octet-stream'):
+        self.source = source
+        if name is None and isinstance(source, str): name = os.path.basename(source)
+        self.name = name
+        self.type = type
+        self.is_buffer = isinstance(source, (bytes, bytearray, memoryview, mmap.mmap))
+        self.start = source.tell() if not self.is_buffer and hasattr(source, 'read') else 0
+
+    def size(self):
+        '''The size of the raw content in bytes'''
+        if isinstance(self.source, str): return os.path.getsize(self.source)
+        if self.is_buffer: return memoryview(self.source).nbytes
+        return self.source.seek(0, io.SEEK_END) - self.start
+
+    def encoded_size(self):
+        return (self.size() + 2) // 3 * 4
+
+    def chunks(self):
+        '''Yield the base64-encoded content chunk by chunk'''
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    yield base64.b64encode(chunk)
+        elif self.is_buffer:
+            view = memoryview(self.source).cast('B')
+            for i in range(0, len(view), self.CHUNK_SIZE):
+                yield base64.b64encode(view[i:i + self.CHUNK_SIZE])
+        else:
+            self.source.seek(self.start)
+            for chunk in iter(lambda: self.source.read(self.CHUNK_SIZE), b''):
+                yield base64.b64encode(chunk)
+
+class StreamingBody(object):
+    '''A JSON request body with the content of Attachment objects spliced in while it is being sent.
+
+    encoded holds the body with a placeholder in place of each attachment content - that is what gets logged.
+    The body can be iterated several times, to retry a call.
+    '''
+    def __init__(self, encoded, attachments):
+        self.encoded = encoded
+        self.attachments = attachments # marker -> Attachment
+        # with a capturing group, the odd items are the markers found in the body, in the order they appear
+        self.parts = re.split(b'(' + b'|'.join(re.escape(marker) for marker in attachments) + b')', encoded)
+
+    def __len__(self):
+        return sum(len(part) if i % 2 == 0 else self.attachments[part].encoded_size() for i, part in enumerate(self.parts))
+
+    def __iter__(self):
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                yield part
+            else:
+                for chunk in self.attachments[part].chunks():
+                    yield chunk
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
+
+def encode_streaming(codec, params):
+    '''Encode params, returning a StreamingBody if the message they carry has Attachment objects'''
+    message = params.get('message')
+    if not isinstance(message, dict) or not any(isinstance(item, Attachment) for field in ('attachments', 'images') for item in message.get(field) or []):
+        return codec.encode(params)
+    attachments = {}
+    def placeholder(item):
+        if not isinstance(item, Attachment): return item
+        marker = 'mandrill-attachment-%s' % uuid.uuid4().hex
+        attachments[marker.encode('ascii')] = item
+        return {'type': item.type, 'name': item.name, 'content': marker}
+    message = dict(message)
+    for field in ('attachments', 'images'):
+        if message.get(field): message[field] = [placeholder(item) for item in message[field]]
+    return StreamingBody(codec.encode(dict(params, message=message)), attachments)
+
+class AttachmentFile(object):
+    '''Stands for the content of an attachment or image in the results of Messages.content_stream and
+    Messages.parse_stream: the decoded content was written to file as it was received.
+
+    kind is 'attachments' or 'images', index the position in that array, size the number of bytes written.
+    '''
+    def __init__(self, kind, index, file, encoded):
+        self.kind = kind
+        self.index = index
+        self.file = file
+        self.encoded = encoded # True for base64 content, False for text, None until the binary flag is known
+        self.name = None
+        self.type = None
+        self.size = 0
+        self.pending = b''
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.high_surrogate = ''
+
+    def feed(self, piece):
+        '''Write a piece of the raw JSON-escaped content.  Pieces never split an escape sequence, but may split a
+        UTF-8 sequence or a \\uXXXX surrogate pair, whose first half is then kept for the next piece.'''
+        text = stdlib_json.loads('"%s"' % self.decoder.decode(piece))
+        if self.high_surrogate:
+            text = (self.high_surrogate + text).encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'surrogatepass')
+            self.high_surrogate = ''
+        if text and '\ud800' <= text[-1] <= '\udbff':
+            text, self.high_surrogate = text[:-1], text[-1]
+        self.write(text)
+
+    def write(self, text):
+        data = text.encode('utf-8', 'surrogatepass')
+        if self.encoded: data = self.decode(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def decode(self, data):
+        '''Decode as much base64 as possible, keeping an incomplete quantum for the next call'''
+        data = self.pending + data.translate(None, b' \r\n')
+        cut = len(data) // 4 * 4
+        self.pending = data[cut:]
+        return base64.b64decode(data[:cut])
+
+    def close(self, fields):
+        '''Complete the file once all the fields of the struct holding the content are known'''
+        self.name = fields.get('name')
+        self.type = fields.get('type')
+        try:
+            self.decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise Error('The content of %s[%d] is not valid UTF-8' % (self.kind, self.index))
+        if self.high_surrogate: self.write(self.high_surrogate) # unpaired, kept as is like json.loads does
+        if self.encoded is None and fields.get('binary'):
+            self.decode_in_place()
+        if self.pending:
+            raise Error('The content of %s[%d] is not valid base64' % (self.kind, self.index))
+        if self.file.seekable(): self.file.seek(0)
+
+    def decode_in_place(self):
+        '''Decode base64 content already written to the file, which must be readable and seekable'''
+        read_at = write_at = 0
+        while read_at < self.size:
+            self.file.seek(read_at)
+            chunk = self.file.read(Attachment.CHUNK_SIZE // 3 * 4)
+            read_at += len(chunk)
+            chunk = self.decode(chunk)
+            self.file.seek(write_at)
+            self.file.write(chunk)
+            write_at += len(chunk)
+        self.file.truncate(write_at)
+        self.size = write_at
+
+    def __repr__(self):
+        return '<AttachmentFile %s[%d] %r %d bytes>' % (self.kind, self.index, self.name, self.size)
+
+STRING_CONTENT_RE = re.compile(rb'(?:[^"\\]+|\\(?:u[0-9a-fA-F]{4}|[^u]))*')
+LITERAL_RE = re.compile(rb'[-+0-9.eE]+|true|false|null')
+WHITESPACE_RE = re.compile(rb'[ \t\r\n]*')
+
+class StreamingResultParser(object):
+    '''Incremental JSON parser for the results of messages/content and messages/parse.
+
+    The content of attachments[] and images[] is decoded and written to the file returned by
+    opener(kind, index) as it arrives, and replaced by an AttachmentFile in the result - everything else is
+    parsed as usual.  opener defaults to anonymous temporary files.  With binary_flag, the attachments carry a
+    binary field telling whether their content is base64-encoded, as in the results of messages/parse.
+    '''
+    def __init__(self, chunks, opener=None, binary_flag=False):
+        self.chunks = iter(chunks)
+        self.opener = opener or (lambda kind, index: tempfile.TemporaryFile())
+        self.binary_flag = binary_flag
+        self.buffer = b''
+        self.position = 0
+
+    def parse(self):
+        result = self.value(())
+        self.position = WHITESPACE_RE.match(self.buffer, self.position).end()
+        if self.position < len(self.buffer) or self.fill(): raise Error('Unexpected data after the end of the response')
+        return result
+
+    def fill(self):
+        '''Append the next chunk to the unparsed part of the buffer, returning False at the end of the response'''
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.position:] + chunk
+                self.position = 0
+                return True
+        return False
+
+    def peek(self):
+        '''Skip whitespace and return the next byte without consuming it'''
+        while True:
+            self.position = WHITESPACE_RE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer): return self.buffer[self.position:self.position + 1]
+            if not self.fill(): raise Error('The response ended unexpectedly')
+
+    def expect(self, token):
+        if self.peek() != token: raise Error('Expected %r at offset %d of the response' % (token, self.position))
+        self.position += 1
+
+    def value(self, path):
+        token = self.peek()
+        if token == b'{': return self.object(path)
+        if token == b'[': return self.array(path)
+        if token == b'"':
+            pieces = []
+            self.string(pieces.append)
+            return stdlib_json.loads(b'"' + b''.join(pieces) + b'"')
+        return self.literal()
+
+    def object(self, path):
+        self.expect(b'{')
+        result, content = {}, None
+        if self.peek() == b'}':
+            self.position += 1
+            return result
+        while True:
+            key = self.value(path)
+            self.expect(b':')
+            if key == 'content' and len(path) == 2 and path[0] in ('attachments', 'images') and self.peek() == b'"':
+                encoded = result.get('binary') if self.binary_flag and path[0] == 'attachments' else True
+                content = result[key] = AttachmentFile(path[0], path[1], self.opener(path[0], path[1]), encoded)
+                self.string(content.feed)
+            else:
+                result[key] = self.value(path + (key,))
+            token = self.peek()
+            self.position += 1
+            if token == b'}': break
+            if token != b',': raise Error('Expected , or } at offset %d of the response' % (self.position - 1))
+        if content is not None: content.close(result)
+        return result
+
+    def array(self, path):
+        self.expect(b'[')
+        result = []
+        if self.peek() == b']':
+            self.position += 1
+            return result
+        while True:
+            result.append(self.value(path + (len(result),)))
+            token = self.peek()
+            self.position += 1
+            if token == b']': break
+            if token != b',': raise Error('Expected , or ] at offset %d of the response' % (self.position - 1))
+        return result
+
+    def string(self, feed):
+        '''Consume a string, passing its raw JSON-escaped content to feed in pieces that never split an escape sequence'''
+        self.expect(b'"')
+        while True:
+            match = STRING_CONTENT_RE.match(self.buffer, self.position)
+            if match.end() > self.position: feed(self.buffer[self.position:match.end()])
+            self.position = match.end()
+            if self.position < len(self.buffer) and self.buffer[self.position:self.position + 1] == b'"':
+                self.position += 1
+                return
+            if not self.fill(): raise Error('The response ended in the middle of a string')
+
+    def literal(self):
+        while True:
+            match = LITERAL_RE.match(self.buffer, self.position)
+            if match is not None and match.end() < len(self.buffer):
+                self.position = match.end()
+                return stdlib_json.loads(match.group())
+            if not self.fill():
+                if match is None: raise Error('Unexpected data at offset %d of the response' % self.position)
+                self.position = match.end()
+                return stdlib_json.loads(match.group())
+
+# Read-only endpoints, safe to call more than once for a single logical call
+IDEMPOTENT_ENDPOINTS = (
+    '*/info', '*/list', '*/list-*', '*/time-series', '*/all-time-series', '*/search', '*/search-time-series',
+    '*/check-*', '*/domains', '*/routes', '*/senders', '*/tracking-domains', '*/pool-info',
+    'messages/content', 'messages/parse', 'templates/render', 'users/ping', 'users/ping2',
+)
+
+# Read-only endpoints commonly called from latency-sensitive code, see the hedge_delay option of Mandrill
+HEDGED_ENDPOINTS = ('messages/info', 'messages/content', 'templates/info', 'senders/info')
+
+# The errors RetryPolicy and CircuitBreaker consider transient by default - asyncio and aiohttp ones are added once AsyncMandrill imports them
+RETRYABLE_ERRORS = (ServiceUnavailableError, UnexpectedResponseError, requests.ConnectionError, requests.Timeout)
+
+def import_aiohttp():
+    '''Import asyncio and aiohttp on first use, as they take longer to import than the rest of the client and only AsyncMandrill needs them'''
+    global aiohttp, asyncio, RETRYABLE_ERRORS, TIMEOUT_ERRORS
+    if aiohttp is not None: return
+    import asyncio
+    try:
+        import aiohttp
+    except ImportError:
+        raise Error('AsyncMandrill requires the aiohttp package')
+    RETRYABLE_ERRORS += (asyncio.TimeoutError, aiohttp.ClientConnectionError)
+    TIMEOUT_ERRORS += (asyncio.TimeoutError,)
+
+class RetryPolicy(object):
+    '''When and how long to wait before retrying a failed call.
+
+    Only calls to endpoints matching one of the endpoints patterns are retried, so that a send is never duplicated.
+    Delays grow exponentially from backoff up to max_backoff, with full jitter so that many clients failing at the
+    same time do not retry in lockstep.  Only the errors in retry_on are retried, RETRYABLE_ERRORS by default.
+    '''
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30.0, retry_on=None, endpoints=IDEMPOTENT_ENDPOINTS):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        self.endpoints = endpoints
+
+    def should_retry(self, url, attempt, error):
+        '''Whether the call to url that failed with error on its attempt-th try should be tried again'''
+        if attempt >= self.max_attempts or not isinstance(error, self.retry_on or RETRYABLE_ERRORS):
+            return False
+        if isinstance(error, UnexpectedResponseError) and error.status_code < 500:
+            return False
+        return any(fnmatch.fnmatchcase(url, pattern) for pattern in self.endpoints)
+
+    def delay(self, attempt):
+        '''The number of seconds to wait after the attempt-th try failed'''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+# (endpoint pattern, calls, period in seconds) for the limits documented by the API
+DEFAULT_RATE_LIMITS = (
+    ('messages/search', 20, 60.0),
+)
+
+class RateLimiter(object):
+    '''Token buckets pacing calls per endpoint: a call over its limit waits for a token instead of failing.
+
+    Each (pattern, calls, period) limit allows bursts of up to calls calls, refilled at calls per period seconds,
+    and all the endpoints matching a pattern share its bucket.  send_rate adds a single budget in messages per
+    second for messages/send, send-template and send-raw - e.g. users.info()['hourly_quota'] / 3600.0 - where a
+    call takes one token per recipient, see cost.  An instance can be shared by several clients, threads and
+    asyncio tasks.
+    '''
+    def __init__(self, limits=DEFAULT_RATE_LIMITS, send_rate=None):
+        self.limits = list(limits)
+        self.send_bucket = None
+        if send_rate is not None:
+            self.send_bucket = len(self.limits)
+            self.limits.append(('messages/send*', send_rate, 1.0))
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.state = [(float(calls), None) for pattern, calls, period in self.limits]
+
+    def bucket(self, url):
+        '''The index of the limit applying to url, or None'''
+        if url not in self.buckets:
+            self.buckets[url] = next((i for i, (pattern, calls, period) in enumerate(self.limits) if fnmatch.fnmatchcase(url, pattern)), None)
+        return self.buckets[url]
+
+    def cost(self, url, params):
+        '''The number of tokens a call to url with params takes: one per recipient for the send_rate budget, else one'''
+        if self.send_bucket is None or self.bucket(url) != self.send_bucket or not params: return 1
+        message = params.get('message')
+        recipients = message.get('to') if isinstance(message, dict) else params.get('to')
+        return max(len(recipients or []), 1)
+
+    def reserve(self, url, cost=1):
+        '''Take cost tokens for a call to url and return the number of seconds to wait before making it'''
+        i = self.bucket(url)
+        if i is None: return 0
+        with self.lock:
+            self.state[i], delay = self.take(i, self.state[i], time.time(), cost)
+        return delay
+
+    def take(self, i, state, now, cost=1):
+        '''Refill bucket i from its state up to now and take cost tokens, returning its new state and the wait - tokens go negative while calls are queued'''
+        pattern, calls, period = self.limits[i]
+        tokens, last = state
+        if last is not None: tokens = min(float(calls), tokens + (now - last) * calls / period)
+        tokens -= cost
+        return (tokens, now), max(0, -tokens * period / calls)
+
+    def acquire(self, url, cost=1):
+        '''Wait until a call to url taking cost tokens is allowed'''
+        delay = self.reserve(url, cost)
+        if delay > 0: time.sleep(delay)
+
+    async def acquire_async(self, url, cost=1):
+        '''Coroutine counterpart of acquire, waiting without blocking the event loop'''
+        import asyncio
+        delay = self.reserve(url, cost)
+        if delay > 0: await asyncio.sleep(delay)
+
+class SharedRateLimiter(RateLimiter):
+    '''RateLimiter whose buckets live in a memory-mapped file, so that all the processes of a host using the same path share one budget.
+
+    Every bucket is guarded by an fcntl lock on its own bytes of the file, so an acquire costs a lock, a read
+    and a write of 16 bytes of shared memory.  All the processes sharing a path must be configured with the
+    same limits, in the same order.  Only available on POSIX systems.
+    '''
+    BUCKET = struct.Struct('dd')
+
+    def __init__(self, path, limits=DEFAULT_RATE_LIMITS, send_rate=None):
+        if fcntl is None: raise Error('SharedRateLimiter requires fcntl, which is not available on this platform')
+        super(SharedRateLimiter, self).__init__(limits, send_rate)
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = self.BUCKET.size * max(len(self.limits), 1)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < size: os.ftruncate(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, size)
+
+    def reserve(self, url, cost=1):
+        i = self.bucket(url)
+        if i is None: return 0
+        offset = i * self.BUCKET.size
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.BUCKET.size, offset)
+            try:
+                tokens, last = self.BUCKET.unpack_from(self.map, offset)
+                state = (tokens, last) if last else (float(self.limits[i][1]), None) # a zeroed bucket has never been used
+                (tokens, last), delay = self.take(i, state, time.time(), cost)
+                self.BUCKET.pack_into(self.map, offset, tokens, last)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.BUCKET.size, offset)
+        return delay
+
+    def close(self):
+        '''Release the shared memory and the file descriptor'''
+        self.map.close()
+        os.close(self.fd)
+
+# paces the helpers that fan out over a rate-limited endpoint, such as Messages.search_all, on clients without a rate_limiter
+DEFAULT_RATE_LIMITER = RateLimiter()
+
+class Circuit(object):
+    '''The state of the circuit breaker for one endpoint family'''
+    def __init__(self, window):
+        self.state = 'closed'
+        self.outcomes = collections.deque(maxlen=window)
+        self.opened_at = None
+        self.probes = 0
+        self.trials = 0 # the number of times the circuit went half-open, telling the probes of each time apart
+
+class CircuitBreaker(object):
+    '''Fail fast on an endpoint family (messages/*, templates/*, ...) while the API is degraded for it.
+
+    A call fails when it raises one of failure_on (RETRYABLE_ERRORS by default) or takes longer than slow_call_time seconds.  Once at least
+    min_calls of the last window calls of a family are known and error_rate of them failed, its circuit opens:
+    calls raise CircuitOpenError right away for reset_timeout seconds.  The circuit is then half-open and lets
+    up to probes calls through - it closes again on the first success, and reopens on the first failure.
+    Only the probes settle a half-open circuit: calls that started before it opened are ignored.
+    An instance can be shared by several clients and threads; state() exposes it for health checks.
+    '''
+    def __init__(self, error_rate=0.5, window=20, min_calls=10, slow_call_time=None, reset_timeout=30.0, probes=1, failure_on=None):
+        self.error_rate = error_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.slow_call_time = slow_call_time
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.failure_on = failure_on
+        self.lock = threading.Lock()
+        self.circuits = {}
+
+    def circuit(self, url):
+        family = url.split('/', 1)[0]
+        if family not in self.circuits: self.circuits[family] = Circuit(self.window)
+        return self.circuits[family]
+
+    def before(self, url):
+        '''Raise CircuitOpenError if a call to url must not be made now, else return the probe it makes of a half-open circuit (None if it is not one), to pass on to record or release'''
+        with self.lock:
+            circuit = self.circuit(url)
+            if circuit.state == 'open':
+                if time.time() - circuit.opened_at < self.reset_timeout:
+                    raise CircuitOpenError('The circuit for %s/* is open after too many failures' % url.split('/', 1)[0])
+                circuit.state = 'half-open'
+                circuit.probes = 0
+                circuit.trials += 1
+            if circuit.state == 'half-open':
+                if circuit.probes >= self.probes:
+                    raise CircuitOpenError('The circuit for %s/* is half-open and already probing' % url.split('/', 1)[0])
+                circuit.probes += 1
+                return circuit.trials
+            return None
+
+    def record(self, url, elapsed, error=None, probe=None):
+        '''Record the outcome of a call to url that took elapsed seconds and raised error, if any - probe is what before returned for it'''
+        failed = isinstance(error, self.failure_on or RETRYABLE_ERRORS) or (self.slow_call_time is not None and elapsed > self.slow_call_time)
+        with self.lock:
+            circuit = self.circuit(url)
+            if probe is not None:
+                if not self.probing(circuit, probe): return # settled by another probe in the meantime
+                circuit.probes -= 1
+                if failed:
+                    self.trip(url, circuit)
+                else:
+                    circuit.state = 'closed'
+                    circuit.outcomes.clear()
+            elif circuit.state == 'closed':
+                circuit.outcomes.append(failed)
+                if len(circuit.outcomes) >= self.min_calls and sum(circuit.outcomes) >= self.error_rate * len(circuit.outcomes):
+                    self.trip(url, circuit)
+
+    def release(self, url, probe=None):
+        '''Forget a call to url that was interrupted (cancelled, KeyboardInterrupt...) before it had an outcome, freeing its probe'''
+        with self.lock:
+            circuit = self.circuit(url)
+            if probe is not None and self.probing(circuit, probe): circuit.probes -= 1
+
+    def probing(self, circuit, probe):
+        '''Whether probe is still in flight for the current half-open state of circuit'''
+        return circuit.state == 'half-open' and circuit.trials == probe
+
+    def trip(self, url, circuit):
+        circuit.state = 'open'
+        circuit.opened_at = time.time()
+        circuit.outcomes.clear()
+        logger.warning('Opened the circuit for %s/* after too many failed calls', url.split('/', 1)[0])
+
+    def state(self, family=None):
+        '''The state ('closed', 'open' or 'half-open') of an endpoint family, or a dict of all the known ones'''
+        with self.lock:
+            if family is not None:
+                circuit = self.circuits.get(family)
+                return circuit.state if circuit is not None else 'closed'
+            return dict((family, circuit.state) for family, circuit in self.circuits.items())
+
+# Seconds the results of read-mostly endpoints are cached for, see ResponseCache
+CACHE_TTLS = {
+    'templates/info': 300,
+    'templates/list': 300,
+    'senders/domains': 300,
+    'tags/list': 300,
+    'subaccounts/info': 300,
+    'webhooks/list': 300,
+    'ips/list-pools': 300,
+}
+
+class ResponseCache(object):
+    '''Bounded LRU cache of the responses of read-mostly endpoints, each kept for its TTL from ttls.
+
+    Entries are keyed on the endpoint and its canonicalised params - the API key only contributes a hash, so
+    that clients of different accounts can share a cache.  A call going through the cache to any endpoint of
+    the same family that is not in IDEMPOTENT_ENDPOINTS (templates/update, tags/delete, subaccounts/pause, ...)
+    invalidates all the cached responses of the family.  An instance can be shared by several clients and threads.
+    '''
+    def __init__(self, ttls=CACHE_TTLS, maxsize=1024):
+        self.ttls = ttls
+        self.maxsize = maxsize
+        self.families = set(url.split('/', 1)[0] for url in ttls)
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def key(self, url, params, apikey):
+        '''The cache key of a call, or None if url is not cacheable'''
+        if url not in self.ttls: return None
+        params = dict((name, value) for name, value in (params or {}).items() if name != 'key')
+        account = hashlib.sha1(apikey.encode('utf-8')).hexdigest()[:16]
+        return '%s %s %s' % (url, account, stdlib_json.dumps(params, sort_keys=True, separators=(',', ':'), default=str))
+
+    def get(self, key):
+        '''The encoded response stored for key, or None'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: return None
+            data, expires = entry
+            if expires <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def set(self, key, data):
+        '''Store the encoded response of the call identified by key'''
+        expires = time.time() + self.ttls[key.split(' ', 1)[0]]
+        with self.lock:
+            self.entries[key] = (data, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, url):
+        '''Drop the cached responses made stale by a call to url'''
+        family = url.split('/', 1)[0]
+        if family not in self.families or any(fnmatch.fnmatchcase(url, pattern) for pattern in IDEMPOTENT_ENDPOINTS): return
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(family + '/')]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class DiskCache(ResponseCache):
+    '''ResponseCache persisted in a SQLite database under directory, so that short-lived processes (cron jobs,
+    the mandrill CLI, sendmail.mandrill) can reuse the metadata fetched by previous ones.
+
+    The database is in WAL mode, so any number of processes and threads can read and write it concurrently.
+    Expired entries are purged as new ones are written, and once there are more than maxsize the ones closest
+    to expiring are evicted.  Setting MANDRILL_CACHE_DIR in the environment makes every client use one by default.
+    '''
+    def __init__(self, directory=None, ttls=CACHE_TTLS, maxsize=10000):
+        super(DiskCache, self).__init__(ttls, maxsize)
+        if directory is None: directory = os.environ.get('MANDRILL_CACHE_DIR') or os.path.expanduser('~/.cache/mandrill')
+        os.makedirs(directory, 0o700, exist_ok=True)
+        self.path = os.path.join(directory, 'responses.sqlite3')
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, family TEXT NOT NULL, data BLOB NOT NULL, expires REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)')
+
+    def connection(self):
+        '''The connection of the current thread and process to the database'''
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = sqlite3.connect(self.path, timeout=10)
+            self.local.db.execute('PRAGMA journal_mode=WAL')
+            self.local.db.execute('PRAGMA synchronous=NORMAL')
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def get(self, key):
+        row = self.connection().execute('SELECT data FROM responses WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def set(self, key, data):
+        now = time.time()
+        url = key.split(' ', 1)[0]
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO responses (key, family, data, expires) VALUES (?, ?, ?, ?)', (key, url.split('/', 1)[0], data, now + self.ttls[url]))
+            db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+            db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def invalidate(self, url):
+        family = url.split('/', 1)[0]
+        if family not in self.families or any(fnmatch.fnmatchcase(url, pattern) for pattern in IDEMPOTENT_ENDPOINTS): return
+        with self.connection() as db:
+            db.execute('DELETE FROM responses WHERE family = ?', (family,))
+
+    def clear(self):
+        with self.connection() as db:
+            db.execute('DELETE FROM responses')
+
+call_timeouts = contextvars.ContextVar('mandrill_call_timeouts', default=(None, None))
+
+@contextlib.contextmanager
+def timeouts(timeout=None, deadline=None):
+    '''Bound the calls made in this block by the current thread or asyncio task, whichever client makes them::
+
+        with mandrill.timeouts(timeout=(1, 5), deadline=10):
+            m.messages.send(message)
+
+    Args:
+       timeout (float|tuple|None): the timeout of each HTTP request, or a (connect, read) pair, overriding the client's
+       deadline (float|None): the number of seconds from now all the calls - including their retries - must complete in, else they raise DeadlineExceededError; nested blocks can only shorten it
+    '''
+    outer_timeout, outer_deadline = call_timeouts.get()
+    if deadline is not None:
+        deadline = time.time() + deadline
+        if outer_deadline is not None: deadline = min(deadline, outer_deadline)
+    else:
+        deadline = outer_deadline
+    token = call_timeouts.set((timeout if timeout is not None else outer_timeout, deadline))
+    try:
+        yield
+    finally:
+        call_timeouts.reset(token)
+
+def submit(pool, func, *args):
+    '''Submit func(*args) to a thread pool in a copy of the current context, so that it runs within the caller's timeouts block'''
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+def remaining_time(deadline):
+    '''The number of seconds left before deadline, raising DeadlineExceededError if there are none'''
+    remaining = deadline - time.time()
+    if remaining <= 0: raise DeadlineExceededError('The deadline of the call was exceeded')
+    return remaining
+
+TIMEOUT_ERRORS = (requests.Timeout, requests.packages.urllib3.exceptions.ReadTimeoutError) # and asyncio.TimeoutError, see import_aiohttp
+
+def exceeded_deadline(error, deadline):
+    '''Whether error is the timeout of a request clipped to deadline, which fires once the deadline is over (give or take the clock granularity).
+    A read timeout while a response is streamed comes wrapped in a requests.ConnectionError.'''
+    if isinstance(error, requests.ConnectionError) and not isinstance(error, TIMEOUT_ERRORS) and error.args: error = error.args[0]
+    return deadline is not None and isinstance(error, TIMEOUT_ERRORS) and deadline - time.time() < 0.01
+
 logger = logging.getLogger('mandrill')
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler(sys.stderr))
 
 class Mandrill(object):
-    def __init__(self, apikey=None, debug=False):
+    '''The API client.
+
+    A single instance can be shared by any number of threads: calls share the session's connection pool
+    (see pool_maxsize) and last_request holds the last call made by the current thread only.
+    '''
+    def __init__(self, apikey=None, debug=False, pool_connections=10, pool_maxsize=10, pool_block=False, keepalive_timeout=None, keep_last_request=True, log_body_limit=None, codec=None, compress_threshold=None, retry=None, rate_limiter=None, circuit_breaker=None, timeout=None, hedge_delay=None, hedge_endpoints=HEDGED_ENDPOINTS, cache=None):
         '''Initialize the API client
 
         Args:
@@ -115,14 +868,53 @@ class Mandrill(object):
                - ~/.mandrill.key for the user executing the script
                - /etc/mandrill.key
            debug (bool): set to True to log all the request and response information to the "mandrill" logger at the INFO level.  When set to false, it will log at the DEBUG level.  By default it will write log entries to STDERR
+           pool_connections (int): the number of per-host connection pools to keep around
+           pool_maxsize (int): the maximum number of connections kept open to a single host - raise it above the number of threads sharing this client
+           pool_block (bool): set to True to make calls wait for a free pooled connection instead of opening extra throwaway ones once pool_maxsize are in use
+           keepalive_timeout (float|None): close the pooled connections when the client has been idle for this many seconds, instead of trying to reuse connections the server may have dropped
+           keep_last_request (bool|str): what to keep in last_request after each call - True for everything including the request and response bodies (as str), 'slim' for only the url, status, time, remote_addr and body sizes, False for nothing
+           log_body_limit (int|None): truncate the request and response bodies written to the log to this many characters
+           codec (str|object|None): the JSON codec used for request and response bodies - one of the names in mandrill.CODECS ('orjson', 'ujson', 'simplejson', 'json' depending on what is installed), or any object with encode(obj) -> bytes and decode(bytes) -> obj methods.  Defaults to the json module picked at import (ujson, simplejson or json) - 'orjson' is faster but cannot encode integers past 64 bits
+           compress_threshold (int|None): gzip request bodies of at least this many bytes, typically sends with large HTML parts or attachments.  Disabled by default
+           retry (RetryPolicy|None): retry failed calls to idempotent endpoints according to this policy.  Disabled by default
+           rate_limiter (RateLimiter|None): pace calls according to this rate limiter, which may be shared with other clients
+           circuit_breaker (CircuitBreaker|None): fail fast on endpoint families this circuit breaker reports as degraded
+           timeout (float|tuple|None): the default timeout of each HTTP request in seconds, or a (connect, read) pair - see also mandrill.timeouts.  No timeout by default
+           hedge_delay (float|None): when a request to one of hedge_endpoints has not answered after this many seconds - typically its p95 latency - send an identical one on another pooled connection and use whichever answers first.  Disabled by default
+           hedge_endpoints (tuple): the endpoint patterns hedging applies to - only the ones also matching IDEMPOTENT_ENDPOINTS are ever hedged
+           cache (ResponseCache|None): serve the calls to read-mostly endpoints from this cache, which may be shared with other clients.  Defaults to a DiskCache when MANDRILL_CACHE_DIR is set in the environment
        '''
 
-        self.session = requests.session()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keepalive_timeout = keepalive_timeout
+        self.keep_last_request = keep_last_request
+        self.log_body_limit = log_body_limit
+        if codec is None:
+            codec = DEFAULT_CODEC
+        elif isinstance(codec, str):
+            if codec not in CODECS: raise Error('Unknown JSON codec %r, available codecs are: %s' % (codec, ', '.join(sorted(CODECS))))
+            codec = CODECS[codec]
+        self.codec = codec
+        self.compress_threshold = compress_threshold
+        self.retry = retry
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.hedge_endpoints = hedge_endpoints
+        self.hedge_pool = None
+        if cache is None and os.environ.get('MANDRILL_CACHE_DIR'): cache = DiskCache(os.environ['MANDRILL_CACHE_DIR'])
+        self.cache = cache
+        self.last_used = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.session = self.create_session()
         if debug:
             self.level = logging.INFO
         else:
             self.level = logging.DEBUG
-        self.last_request = None
 
         if apikey is None:
             if 'MANDRILL_APIKEY' in os.environ:
@@ -149,30 +941,299 @@ class Mandrill(object):
         self.senders = Senders(self)
         self.metadata = Metadata(self)
 
-    def call(self, url, params=None):
-        '''Actually make the API call with the given params - this should only be called by the namespace methods - use the helpers in regular usage like m.tags.list()'''
-        if params is None: params = {}
-        params['key'] = self.apikey
-        params = json.dumps(params)
-        self.log('POST to %s%s.json: %s' % (ROOT, url, params))
+    @property
+    def last_request(self):
+        '''Details about the last call made by the current thread, or None'''
+        return getattr(self.local, 'last_request', None)
+
+    @last_request.setter
+    def last_request(self, value):
+        self.local.last_request = value
+
+    def call(self, url, params=None, timeout=None, deadline=None):
+        '''Actually make the API call with the given params - this should only be called by the namespace methods - use the helpers in regular usage like m.tags.list()
+
+        timeout and deadline override the ones set by the client and mandrill.timeouts for this call only.
+        '''
+        key, data = self.cache_lookup(url, params)
+        if data is not None: return self.codec.decode(data)
+        try:
+            result = self.call_api(url, params, timeout, deadline)
+        finally:
+            self.cache_invalidate(url, key)
+        self.cache_store(key, result)
+        return result
+
+    def call_api(self, url, params=None, timeout=None, deadline=None):
+        '''Make the API call, retrying it according to the retry policy'''
+        params, body, headers, timeout, deadline, cost = self.prepare(url, params, timeout, deadline)
+        attempts = 1
+        while True:
+            try:
+                return self.attempt(url, params, body, headers, timeout, deadline, cost)
+            except Exception as e:
+                time.sleep(self.retry_delay(url, attempts, e, deadline))
+                attempts += 1
+
+    def cache_lookup(self, url, params):
+        '''Return the cache key of a call (None if it is not cacheable) and its cached encoded result, if any'''
+        if self.cache is None: return None, None
+        key = self.cache.key(url, params, self.apikey)
+        return key, self.cache.get(key) if key is not None else None
+
+    def cache_invalidate(self, url, key):
+        '''Drop the cached responses made stale by a call to url that is not cacheable, whether it succeeded or not'''
+        if self.cache is not None and key is None: self.cache.invalidate(url)
+
+    def cache_store(self, key, result):
+        if key is not None: self.cache.set(key, self.codec.encode(result))
+
+    def prepare(self, url, params, timeout, deadline):
+        '''Encode the params of a call to url and resolve its timeouts, returning the arguments of attempt'''
+        cost = self.rate_limiter.cost(url, params) if self.rate_limiter is not None else 1
+        params = self.encode_params(url, params)
+        body, headers = self.compress(params)
+        timeout, deadline = self.resolve_timeouts(timeout, deadline)
+        return params, body, headers, timeout, deadline, cost
+
+    def retry_delay(self, url, attempts, error, deadline):
+        '''Return the number of seconds to wait before retrying a call to url whose attempts-th try raised error, or raise the error the call fails with'''
+        if exceeded_deadline(error, deadline): raise DeadlineExceededError('The deadline of the call was exceeded') from error
+        if self.retry is None or not self.retry.should_retry(url, attempts, error): raise error
+        delay = self.retry.delay(attempts)
+        if deadline is not None and time.time() + delay >= deadline: raise error
+        self.log('Retrying %s in %.2fs after attempt %d failed: %r', url, delay, attempts, error)
+        return delay
+
+    def resolve_timeouts(self, timeout, deadline):
+        '''Return the timeout of each request of a call and the time its deadline expires at, if any'''
+        context_timeout, context_deadline = call_timeouts.get()
+        if timeout is None: timeout = context_timeout if context_timeout is not None else self.timeout
+        if deadline is not None:
+            deadline = time.time() + deadline
+            if context_deadline is not None: deadline = min(deadline, context_deadline)
+        else:
+            deadline = context_deadline
+        return timeout, deadline
+
+    def clip_timeout(self, timeout, deadline):
+        '''Shorten the timeout of a request so that it does not run past deadline'''
+        if deadline is None: return timeout
+        remaining = remaining_time(deadline)
+        if timeout is None: return remaining
+        if isinstance(timeout, tuple): return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+    def attempt(self, url, params, body, headers, timeout=None, deadline=None, cost=1):
+        '''Make one attempt at a call to url, going through the circuit breaker and the rate limiter - where it takes cost tokens'''
+        request = self.hedged_request if self.should_hedge(url) else self.request
+        with self.guarded(url, deadline, cost) as delay:
+            if delay > 0: time.sleep(delay)
+            return request(url, params, body, headers, timeout, deadline)
+
+    @contextlib.contextmanager
+    def guarded(self, url, deadline=None, cost=1):
+        '''Go through the circuit breaker, then take cost tokens from the rate limiter for a call to url, yielding the number of seconds to wait before making it.
+
+        Records the outcome of the call - one interrupted or cut short by its deadline only releases its probe.
+        A call refused by the circuit breaker takes no tokens.
+        '''
+        if self.circuit_breaker is None:
+            yield self.rate_limiter.reserve(url, cost) if self.rate_limiter is not None else 0
+            return
+        if deadline is not None: remaining_time(deadline) # an expired call must not take, let alone settle, a probe
+        probe = self.circuit_breaker.before(url)
+        start = time.time()
+        try:
+            delay = self.rate_limiter.reserve(url, cost) if self.rate_limiter is not None else 0
+            start += delay # the call starts once it has waited for its tokens
+            yield delay
+        except Exception as e:
+            if isinstance(e, DeadlineExceededError) or exceeded_deadline(e, deadline):
+                self.circuit_breaker.release(url, probe)
+            else:
+                self.circuit_breaker.record(url, time.time() - start, e, probe)
+            raise
+        except BaseException:
+            self.circuit_breaker.release(url, probe)
+            raise
+        self.circuit_breaker.record(url, time.time() - start, probe=probe)
+
+    def should_hedge(self, url):
+        '''Whether requests to url are hedged'''
+        return (self.hedge_delay is not None and any(fnmatch.fnmatchcase(url, pattern) for pattern in self.hedge_endpoints)
+                and any(fnmatch.fnmatchcase(url, pattern) for pattern in IDEMPOTENT_ENDPOINTS))
+
+    def hedged_request(self, url, params, body, headers, timeout=None, deadline=None):
+        '''Make a request, and an identical one if it has not answered hedge_delay seconds after it started, returning the first successful response.
+
+        Both run on a pool of their own with room for a request and its hedge on each of the pool_maxsize
+        connections, and the delay only counts from the moment the first request starts: time spent queued
+        for a worker never triggers a hedge.
+        '''
+        with self.lock:
+            if self.hedge_pool is None: self.hedge_pool = futures.ThreadPoolExecutor(2 * self.pool_maxsize)
+        started = threading.Event()
+        def run():
+            started.set()
+            self.last_request = None # left by an earlier request of this worker thread
+            try:
+                return self.request(url, params, body, headers, timeout, deadline), None, self.last_request
+            except Exception as e:
+                return None, e, None
+            finally:
+                self.last_request = None # or the worker would keep the response alive
+
+        pending = [self.hedge_pool.submit(run)]
+        started.wait()
+        if not futures.wait(pending, self.hedge_delay).done:
+            self.log('Hedging %s after %.2fs without a response', url, self.hedge_delay)
+            pending.append(self.hedge_pool.submit(run))
+        errors = []
+        for future in futures.as_completed(pending):
+            result, error, last_request = future.result()
+            if error is None:
+                self.last_request = last_request
+                return result
+            errors.append(error)
+        raise errors[0]
+
+    def request(self, url, params, body, headers, timeout=None, deadline=None):
+        '''Make a single HTTP request for a call to url and decode its response'''
+        timeout = self.clip_timeout(timeout, deadline)
         start = time.time()
-        r = self.session.post('%s%s.json' % (ROOT, url), data=params, headers={'content-type': 'application/json', 'user-agent': 'Mandrill-Python/1.0.58'})
+        if self.keepalive_timeout is not None:
+            with self.lock:
+                if self.last_used is not None and start - self.last_used > self.keepalive_timeout:
+                    for adapter in self.session.adapters.values():
+                        adapter.close()
+                self.last_used = start
+        r = self.session.post('%s%s.json' % (ROOT, url), data=body, headers=headers, timeout=timeout)
         try:
             remote_addr = r.raw._original_response.fp._sock.getpeername() # grab the remote_addr before grabbing the text since the socket will go away
         except:
             remote_addr = (None, None) #we use two private fields when getting the remote_addr, so be a little robust against errors
 
-        response_body = r.text
-        complete_time = time.time() - start
-        self.log('Received %s in %.2fms: %s' % (r.status_code, complete_time * 1000, r.text))
-        self.last_request = {'url': url, 'request_body': params, 'response_body': r.text, 'remote_addr': remote_addr, 'response': r, 'time': complete_time}
+        response_body = r.content
+        return self.decode_response(url, params, r.status_code, response_body, remote_addr, r, time.time() - start)
+
+    def call_streaming(self, url, params, parse, timeout=None, deadline=None):
+        '''Make the API call and return parse(chunks), where chunks iterates over the response body as it is received.
+
+        For responses too large to be decoded in memory at once.  The call goes through the rate limiter and
+        the circuit breaker, but is neither retried, hedged nor cached.
+        '''
+        params, body, headers, timeout, deadline, cost = self.prepare(url, params, timeout, deadline)
+        try:
+            with self.guarded(url, deadline, cost) as delay:
+                if delay > 0: time.sleep(delay)
+                start = time.time()
+                with self.session.post('%s%s.json' % (ROOT, url), data=body, headers=headers, timeout=self.clip_timeout(timeout, deadline), stream=True) as r:
+                    if r.status_code != requests.codes.ok:
+                        return self.decode_response(url, params, r.status_code, r.content, (None, None), r, time.time() - start)
+                    result = parse(r.iter_content(Attachment.CHUNK_SIZE))
+                    self.log('Received %s in %.2fms: streamed', r.status_code, (time.time() - start) * 1000)
+                    if self.keep_last_request: self.last_request = {'url': url, 'status': r.status_code, 'remote_addr': (None, None), 'time': time.time() - start, 'request_size': len(params)}
+                return result
+        except Exception as e:
+            if exceeded_deadline(e, deadline): raise DeadlineExceededError('The deadline of the call was exceeded') from e
+            raise
+
+    def encode_params(self, url, params):
+        '''Add the API key to the params of a call to url, serialize them and log the outgoing request'''
+        if params is None: params = {}
+        params['key'] = self.apikey
+        params = encode_streaming(self.codec, params)
+        if logger.isEnabledFor(self.level):
+            self.log('POST to %s%s.json: %s', ROOT, url, self.log_body(params))
+        return params
+
+    def compress(self, body):
+        '''Return the body to post and its headers, gzipping it when it is at least compress_threshold bytes long - streamed bodies are sent as is'''
+        if isinstance(body, StreamingBody):
+            return body, dict(HEADERS, **{'content-length': str(len(body))})
+        if self.compress_threshold is None or len(body) < self.compress_threshold:
+            return body, HEADERS
+        return gzip.compress(body), GZIP_HEADERS
+
+    def decode_response(self, url, params, status_code, response_body, remote_addr, response, complete_time):
+        '''Log and record a response received for a call to url, then return its decoded result or raise the matching error'''
+        if logger.isEnabledFor(self.level):
+            self.log('Received %s in %.2fms: %s', status_code, complete_time * 1000, self.log_body(response_body))
+        if self.keep_last_request:
+            last_request = {'url': url, 'status': status_code, 'remote_addr': remote_addr, 'time': complete_time, 'request_size': len(params), 'response_size': len(response_body)}
+            if self.keep_last_request != 'slim':
+                request_body = params.encoded if isinstance(params, StreamingBody) else params
+                last_request.update(request_body=request_body.decode('utf-8'), response_body=response_body.decode('utf-8', 'replace'), response=response)
+            self.last_request = last_request
 
-        result = json.loads(response_body)
+        try:
+            result = self.codec.decode(response_body)
+        except ValueError:
+            raise UnexpectedResponseError('We received an unexpected response with status %s: %r' % (status_code, response_body[:200]), status_code)
 
-        if r.status_code != requests.codes.ok:
+        if status_code != requests.codes.ok:
             raise self.cast_error(result)
         return result
 
+    def map(self, func, items, concurrency=10, ordered=True):
+        '''Call func on every item from a pool of concurrency worker threads sharing this client.
+
+        Yields one outcome per item, either in input order or, when ordered is False, as (index, outcome) pairs as
+        they complete - index being the position of the item in items. A call raising a mandrill.Error or a
+        transport error (requests.RequestException) yields the exception instance instead of aborting the whole
+        batch. At most 2 * concurrency items are pulled from items ahead of the results being consumed, and the
+        ones not started yet are dropped if the caller stops iterating.
+        '''
+        with futures.ThreadPoolExecutor(concurrency) as pool:
+            pending = collections.deque()
+            try:
+                for index, item in enumerate(items):
+                    pending.append((index, submit(pool, _capture_error, func, item)))
+                    if len(pending) >= concurrency * 2:
+                        yield self._next_outcome(pending, ordered)
+                while pending:
+                    yield self._next_outcome(pending, ordered)
+            finally:
+                for index, future in pending: future.cancel()
+
+    def gather(self, func, items, concurrency=10):
+        '''Like map, but return the list of all the outcomes in input order'''
+        return list(self.map(func, items, concurrency))
+
+    def then(self, result, func):
+        '''Apply func to the result of a call - on AsyncMandrill this chains it on the awaitable instead'''
+        return func(result)
+
+    def resolved(self, value):
+        '''Return value as the result of a call - on AsyncMandrill as an awaitable, for methods that can answer without calling the API'''
+        return value
+
+    def _next_outcome(self, pending, ordered):
+        if ordered:
+            return pending.popleft()[1].result()
+        done = futures.wait([future for index, future in pending], return_when=futures.FIRST_COMPLETED).done
+        index, future = next(entry for entry in pending if entry[1] in done)
+        pending.remove((index, future))
+        return index, future.result()
+
+    def require_sync(self, feature):
+        '''Raise an Error if feature cannot be used with this client - only AsyncMandrill has such features'''
+        pass
+
+    def create_session(self):
+        '''Create the HTTP session used to talk to the API, with a connection pool sized from the constructor options'''
+        session = requests.session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def warm_up(self, connections=None):
+        '''Open connections to the API ahead of time by issuing that many concurrent pings (pool_maxsize by default), so the first burst of calls does not pay the TLS handshakes in series'''
+        if connections is None: connections = self.pool_maxsize
+        return self.gather(lambda i: self.users.ping(), range(connections), connections)
+
     def cast_error(self, result):
         '''Take a result representing an error and cast it to a specific exception if possible (use a generic mandrill.Error exception for unknown cases)'''
         if not 'status' in result or result['status'] != 'error' or not 'name' in result:
@@ -197,6 +1258,14 @@ class Mandrill(object):
 
         return None
 
+    def log_body(self, body):
+        '''Return body as it should appear in the log, truncated to log_body_limit characters'''
+        if isinstance(body, StreamingBody): body = body.encoded
+        body = body.decode('utf-8', 'replace')
+        if self.log_body_limit is None or len(body) <= self.log_body_limit:
+            return body
+        return '%s... (%d characters)' % (body[:self.log_body_limit], len(body))
+
     def log(self, *args, **kwargs):
         '''Proxy access to the mandrill logger, changing the level based on the debug setting'''
         logger.log(self.level, *args, **kwargs)
@@ -204,6 +1273,507 @@ class Mandrill(object):
     def __repr__(self):
         return '<Mandrill %s>' % self.apikey
 
+def split_message(message, chunk_size):
+    '''Split a message struct by recipient into messages of at most chunk_size recipients each.
+
+    Every chunk carries the message-wide fields unchanged, and only the merge_vars and recipient_metadata
+    entries of its own recipients.
+    '''
+    if message.get('preserve_recipients'): raise Error('A message with preserve_recipients cannot be split by recipient')
+    recipients = message.get('to') or []
+    chunks = []
+    for i in range(0, max(len(recipients), 1), chunk_size):
+        to = recipients[i:i + chunk_size]
+        emails = set(recipient['email'].lower() for recipient in to)
+        chunk = dict(message, to=to)
+        for field in ('merge_vars', 'recipient_metadata'):
+            if message.get(field):
+                chunk[field] = [entry for entry in message[field] if entry['rcpt'].lower() in emails]
+        chunks.append(chunk)
+    return chunks
+
+def merge_results(outcomes):
+    '''Concatenate the per-recipient results of the chunks of a split message, raising PartialSendError if any chunk failed'''
+    results, errors = [], []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            errors.append(outcome)
+        else:
+            results.extend(outcome)
+    if errors: raise PartialSendError('%d of %d chunks failed, first error: %s' % (len(errors), len(outcomes), errors[0]), results, errors)
+    return results
+
+EDITABLE_RE = re.compile(r'''<([a-zA-Z][\w:-]*)\b[^>]*?\smc:edit\s*=\s*(["'])(.*?)\2[^>]*>''', re.S)
+MAILCHIMP_TAG_RE = re.compile(r'\*\|([^|*:]+)\|\*')
+# Plain {{var}} and {{{var}}} tags only: block helpers ({{#if}}, {{/each}}...), {{else}}, {{this}} and helpers taking arguments are left as is
+HANDLEBARS_TAG_RE = re.compile(r'\{\{\{\s*((?!(?:else|this)\b)[\w.]+)\s*\}\}\}|\{\{\s*((?!(?:else|this)\b)[\w.]+)\s*\}\}')
+
+def inject_content(code, template_content):
+    '''Replace the content of the mc:edit regions of code with the matching template_content entries, as templates/render does'''
+    contents = dict((block['name'], block['content']) for block in template_content or [])
+    output, position = [], 0
+    for match in EDITABLE_RE.finditer(code):
+        if match.start() < position or match.group(3) not in contents: continue
+        tag = match.group(1)
+        tags = re.compile(r'<(/?)%s\b[^>]*>' % re.escape(tag), re.I)
+        depth = 1
+        for inner in tags.finditer(code, match.end()):
+            depth += -1 if inner.group(1) else 1
+            if depth == 0: break
+        else:
+            continue # no closing tag, leave the region alone
+        output.append(code[position:match.end()])
+        output.append(contents[match.group(3)])
+        position = inner.start()
+    output.append(code[position:])
+    return ''.join(output)
+
+class CompiledTemplate(object):
+    '''Template code parsed once into its literal text and merge tags, to be rendered cheaply for many recipients.
+
+    With the mailchimp language, *|NAME|* tags are case-insensitive and replaced as is, and tags without a
+    value become empty.  With handlebars, {{name}} is HTML-escaped while {{{name}}} is not, and name may be a
+    dotted path into structured content.
+    '''
+    def __init__(self, code, merge_language='mailchimp'):
+        self.merge_language = merge_language
+        self.literals, self.tags = [], []
+        position = 0
+        for match in (HANDLEBARS_TAG_RE if merge_language == 'handlebars' else MAILCHIMP_TAG_RE).finditer(code):
+            self.literals.append(code[position:match.start()])
+            if merge_language == 'handlebars':
+                self.tags.append((tuple((match.group(1) or match.group(2)).split('.')), match.group(1) is not None))
+            else:
+                self.tags.append(match.group(1).strip().upper())
+            position = match.end()
+        self.literals.append(code[position:])
+
+    def values(self, merge_vars):
+        '''Index a list of name/content merge variable structs by name'''
+        if self.merge_language == 'handlebars':
+            return dict((var['name'], var['content']) for var in merge_vars or [])
+        return dict((var['name'].upper(), '' if var['content'] is None else var['content']) for var in merge_vars or [])
+
+    def render(self, merge_vars=None, global_merge_vars=None):
+        '''Render with merge_vars, falling back to global_merge_vars'''
+        values = self.values(global_merge_vars)
+        values.update(self.values(merge_vars))
+        if self.merge_language == 'handlebars':
+            merged = [self.lookup(values, path, raw) for path, raw in self.tags]
+        else:
+            merged = ['%s' % values.get(name, '') for name in self.tags]
+        parts = [None] * (len(self.literals) + len(merged))
+        parts[::2] = self.literals
+        parts[1::2] = merged
+        return ''.join(parts)
+
+    def lookup(self, values, path, raw):
+        value = values
+        for name in path:
+            value = value.get(name) if isinstance(value, dict) else None
+        if value is None: return ''
+        return '%s' % value if raw else html.escape('%s' % value)
+
+    def render_message(self, message):
+        '''Render for every recipient of a message struct with its global_merge_vars and merge_vars, yielding (email, html) pairs'''
+        recipient_vars = dict((entry['rcpt'].lower(), entry.get('vars')) for entry in message.get('merge_vars') or [])
+        for recipient in message.get('to') or []:
+            yield recipient['email'], self.render(recipient_vars.get(recipient['email'].lower()), message.get('global_merge_vars'))
+
+    def personalize(self, message):
+        '''Yield a single-recipient copy of a message struct per recipient, with its html rendered for that recipient - to be sent with Messages.send_many'''
+        for recipient, (email, rendered) in zip(message.get('to') or [], self.render_message(message)):
+            personal = dict(message, to=[recipient], html=rendered)
+            for field in ('merge_vars', 'recipient_metadata'):
+                if message.get(field):
+                    personal[field] = [entry for entry in message[field] if entry['rcpt'].lower() == email.lower()]
+            yield personal
+
+@functools.lru_cache(maxsize=64)
+def compile_template(code, merge_language='mailchimp'):
+    '''Return the CompiledTemplate of code, reusing it for recently compiled code'''
+    return CompiledTemplate(code, merge_language)
+
+def merge(code, merge_vars, merge_language='mailchimp'):
+    '''Replace the merge tags of code with the values of merge_vars (a list of name/content structs), see CompiledTemplate'''
+    return compile_template(code, merge_language).render(merge_vars)
+
+def render_template(code, template_content=None, merge_vars=None, merge_language='mailchimp'):
+    '''Render template code locally the way templates/render does: inject template_content into its mc:edit regions,
+    then replace its merge tags if merge_vars is provided.  Conditional merge tags such as *|IF:NAME|* are left as is.'''
+    code = inject_content(code, template_content)
+    if merge_vars is not None: code = merge(code, merge_vars, merge_language)
+    return code
+
+def export_rows(path, member=None):
+    '''Iterate over the rows of a CSV file of an export archive downloaded with Exports.download, as dicts keyed
+    by the CSV header.  The file is decompressed and decoded lazily, so memory use does not depend on its size.
+
+    Args:
+       path (str): the path of the zip archive
+       member (str|None): the name of the CSV file in the archive, such as activity.csv - defaults to the first CSV file
+    '''
+    with zipfile.ZipFile(path) as archive:
+        if member is None: member = next(name for name in archive.namelist() if name.endswith('.csv'))
+        with archive.open(member) as f:
+            for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline='')):
+                yield row
+
+def import_numpy(feature):
+    '''Import NumPy on first use, as only the columnar helpers need it and it is slow to import'''
+    global numpy
+    if numpy is not None: return
+    try:
+        import numpy
+    except ImportError:
+        raise Error('%s require the numpy package' % feature)
+
+# How the columns of activity.csv are loaded by iter_activity_batches - any other column, such as custom metadata, is kept as strings
+ACTIVITY_COLUMNS = {
+    'Date': ('date', 'datetime'),
+    'Email Address': ('email', 'string'),
+    'Sender': ('sender', 'category'),
+    'Subject': ('subject', 'string'),
+    'Status': ('status', 'category'),
+    'Tags': ('tags', 'tags'),
+    'Subaccount': ('subaccount', 'category'),
+    'Opens': ('opens', 'integer'),
+    'Clicks': ('clicks', 'integer'),
+    'Bounce Detail': ('bounce_detail', 'string'),
+}
+BOUNCE_STATUSES = ('bounced', 'soft-bounced')
+
+class Categories(object):
+    '''The dictionary of a dictionary-encoded column, shared by all the batches of an export so that codes are consistent'''
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values):
+        '''Return the int32 codes of an array of values, adding the new ones to the dictionary'''
+        unique, inverse = numpy.unique(values, return_inverse=True)
+        return self.lookup(unique)[inverse.reshape(-1)]
+
+    def lookup(self, values):
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        for i, value in enumerate(values):
+            value = str(value)
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = self.codes[value]
+        return codes
+
+    def decode(self, codes):
+        return numpy.array(self.values, dtype=object)[codes]
+
+class ActivityBatch(object):
+    '''Rows of an activity export in columnar form.
+
+    columns maps the names from ACTIVITY_COLUMNS to NumPy arrays: datetime64[s] for date, int64 for opens and
+    clicks, int32 codes into categories[name] for sender, status and subaccount, and objects for the other
+    strings.  As a message can have several tags, they are stored exploded: tag_rows[i] is the row of the
+    tag tag_codes[i], a code into categories['tags'].
+    '''
+    def __init__(self, columns, tag_rows, tag_codes, categories):
+        self.columns = columns
+        self.tag_rows = tag_rows
+        self.tag_codes = tag_codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.columns['date'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def decode(self, name):
+        '''The values of a dictionary-encoded column as an array of strings'''
+        return self.categories[name].decode(self.columns[name])
+
+    def counts(self, by):
+        '''Sum sent, opens, clicks and bounces per code of a dictionary-encoded column (or tags), as a dict of arrays indexed by code'''
+        bounced = numpy.isin(self.columns['status'], [self.categories['status'].codes.get(status, -1) for status in BOUNCE_STATUSES])
+        metrics = {'sent': numpy.ones(len(self), dtype=numpy.int64), 'opens': self.columns['opens'], 'clicks': self.columns['clicks'], 'bounces': bounced.astype(numpy.int64)}
+        size = len(self.categories[by].values)
+        if by == 'tags':
+            return dict((metric, numpy.bincount(self.tag_codes, values[self.tag_rows], size).astype(numpy.int64)) for metric, values in metrics.items())
+        return dict((metric, numpy.bincount(self.columns[by], values, size).astype(numpy.int64)) for metric, values in metrics.items())
+
+    def stats(self, by='sender'):
+        '''Sent, opens, clicks and bounces per sender, status, subaccount or tag, as a dict of dicts keyed by value'''
+        return counts_to_stats(self.counts(by), self.categories[by])
+
+def counts_to_stats(counts, categories):
+    return dict((value, dict((metric, int(counts[metric][code])) for metric in counts)) for code, value in enumerate(categories.values) if counts['sent'][code])
+
+def iter_activity_batches(path, batch_size=100000, member='activity.csv'):
+    '''Load an activity export downloaded with Exports.download in columnar batches of batch_size rows, see ActivityBatch.
+    Dictionary-encoded columns share their categories across batches.  Requires NumPy.'''
+    import_numpy('Columnar exports')
+    categories = collections.defaultdict(Categories)
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(member) as f:
+            reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+            header = next(reader)
+            while True:
+                rows = [row for _, row in zip(range(batch_size), reader)]
+                if not rows: return
+                yield activity_batch(header, rows, categories)
+
+def activity_batch(header, rows, categories):
+    columns, tag_rows, tag_codes = {}, None, None
+    for title, values in zip(header, zip(*rows)):
+        name, kind = ACTIVITY_COLUMNS.get(title, (title, 'string'))
+        if kind == 'datetime':
+            columns[name] = numpy.array(values, dtype='datetime64[s]')
+        elif kind == 'integer':
+            values = numpy.array(values)
+            values[values == ''] = '0'
+            columns[name] = values.astype(numpy.int64)
+        elif kind == 'category':
+            columns[name] = categories[name].encode(numpy.array(values))
+        elif kind == 'tags':
+            # explode each distinct tag set once, then expand them to every row with index arithmetic
+            unique, inverse = numpy.unique(numpy.array(values), return_inverse=True)
+            inverse = inverse.reshape(-1)
+            sets = [categories['tags'].lookup([tag for tag in tags.split(',') if tag]) for tags in unique]
+            lengths = numpy.array([len(codes) for codes in sets], dtype=numpy.int64)
+            offsets = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+            flat = numpy.concatenate(sets + [numpy.empty(0, dtype=numpy.int32)])
+            row_lengths = lengths[inverse]
+            tag_rows = numpy.repeat(numpy.arange(len(rows)), row_lengths)
+            positions = numpy.arange(len(tag_rows)) - numpy.repeat(numpy.cumsum(row_lengths) - row_lengths, row_lengths)
+            tag_codes = flat[numpy.repeat(offsets[inverse], row_lengths) + positions]
+        else:
+            columns[name] = numpy.array(values, dtype=object)
+    if tag_rows is None: tag_rows = tag_codes = numpy.empty(0, dtype=numpy.int64)
+    for name in ('sender', 'status', 'subaccount', 'tags'): categories[name] # exist even when the export lacks the column
+    return ActivityBatch(columns, tag_rows, tag_codes, categories)
+
+def load_activity(path, batch_size=100000, member='activity.csv'):
+    '''Load a whole activity export as a single ActivityBatch, reading it batch_size rows at a time'''
+    batches = list(iter_activity_batches(path, batch_size, member))
+    if not batches: raise Error('The export %s has no rows' % path)
+    offsets = numpy.cumsum([0] + [len(batch) for batch in batches[:-1]])
+    columns = dict((name, numpy.concatenate([batch.columns[name] for batch in batches])) for name in batches[0].columns)
+    tag_rows = numpy.concatenate([batch.tag_rows + offset for batch, offset in zip(batches, offsets)])
+    tag_codes = numpy.concatenate([batch.tag_codes for batch in batches])
+    return ActivityBatch(columns, tag_rows, tag_codes, batches[0].categories)
+
+def activity_stats(path, by='sender', batch_size=100000, member='activity.csv'):
+    '''Sent, opens, clicks and bounces per sender, status, subaccount or tag of an activity export, computed batch by
+    batch so that memory use only depends on batch_size and the number of distinct values'''
+    totals, categories = {}, None
+    for batch in iter_activity_batches(path, batch_size, member):
+        categories = batch.categories[by]
+        for metric, counts in batch.counts(by).items():
+            total = totals.get(metric, numpy.zeros(0, dtype=numpy.int64))
+            if len(total) < len(counts): total = numpy.concatenate((total, numpy.zeros(len(counts) - len(total), dtype=numpy.int64)))
+            total[:len(counts)] += counts
+            totals[metric] = total
+    return counts_to_stats(totals, categories) if categories is not None else {}
+
+class TimeSeries(object):
+    '''Hourly stats from a time-series endpoint in columnar form.
+
+    time is a datetime64[h] array (datetime64[D] once resampled) and columns maps each metric of the endpoint -
+    sent, hard_bounces, opens, unique_clicks... - to an int64 array aligned with it.  Requires NumPy.
+    '''
+    def __init__(self, time, columns):
+        import_numpy('Columnar time series')
+        self.time = time
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows):
+        '''Build the columns straight from the structs returned by the API, without an intermediate dict per hour'''
+        import_numpy('Columnar time series')
+        metrics = [name for name in rows[0] if name != 'time'] if rows else []
+        time = numpy.array([row['time'] for row in rows], dtype='datetime64[s]').astype('datetime64[h]')
+        columns = dict((name, numpy.fromiter((row[name] or 0 for row in rows), numpy.int64, len(rows))) for name in metrics)
+        return cls(time, columns)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, name):
+        if name == 'time': return self.time
+        return self.columns[name]
+
+    def resample(self, unit='D'):
+        '''Sum the metrics per day ('D') or per week starting on Monday ('W'), labelled by the first day of the period'''
+        days = self.time.astype('datetime64[D]')
+        if unit == 'W':
+            # datetime64[W] weeks start on Thursday (like the epoch), so shift to the previous Monday by hand
+            days = days - (days.astype(numpy.int64) + 3) % 7
+        elif unit != 'D':
+            raise Error('unit must be D or W, not %r' % (unit,))
+        time, inverse = numpy.unique(days, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        return TimeSeries(time, dict((name, numpy.bincount(inverse, values, len(time)).astype(numpy.int64)) for name, values in self.columns.items()))
+
+    def rate(self, numerator, denominator='sent'):
+        '''numerator / denominator per period as a float64 array, NaN where denominator is 0'''
+        numerator, denominator = self.columns[numerator], self.columns[denominator]
+        result = numpy.full(len(self), numpy.nan)
+        numpy.divide(numerator, denominator, out=result, where=denominator != 0)
+        return result
+
+def _capture_error(func, item):
+    try:
+        return func(item)
+    except (Error, requests.RequestException) as e:
+        return e
+
+class AsyncMandrill(Mandrill):
+    '''Asyncio flavour of the API client, backed by aiohttp.
+
+    It exposes the same namespaces as Mandrill (m.templates, m.messages, ...) with the same
+    signatures, but every namespace method returns a coroutine resolving to the same result
+    or raising the same mandrill.Error subclasses::
+
+        async with mandrill.AsyncMandrill('YOUR_API_KEY') as m:
+            results = await asyncio.gather(*[m.messages.send(message) for message in messages])
+    '''
+    def __init__(self, *args, **kwargs):
+        import_aiohttp()
+        super(AsyncMandrill, self).__init__(*args, **kwargs)
+
+    def create_session(self):
+        '''The aiohttp session has to be created from a running event loop, see get_session'''
+        return None
+
+    def get_session(self):
+        '''Return the aiohttp session, creating it on first use.  aiohttp always waits for a free connection once pool_maxsize are open to the host, so pool_block has no effect here'''
+        if self.session is None or self.session.closed:
+            options = {'limit': self.pool_connections * self.pool_maxsize, 'limit_per_host': self.pool_maxsize}
+            if self.keepalive_timeout is not None: options['keepalive_timeout'] = self.keepalive_timeout
+            connector = aiohttp.TCPConnector(**options)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def call(self, url, params=None, timeout=None, deadline=None):
+        '''Coroutine counterpart of Mandrill.call'''
+        key, data = self.cache_lookup(url, params)
+        if data is not None: return self.codec.decode(data)
+        try:
+            result = await self.call_api(url, params, timeout, deadline)
+        finally:
+            self.cache_invalidate(url, key)
+        self.cache_store(key, result)
+        return result
+
+    async def call_api(self, url, params=None, timeout=None, deadline=None):
+        params, body, headers, timeout, deadline, cost = self.prepare(url, params, timeout, deadline)
+        attempts = 1
+        while True:
+            try:
+                return await self.attempt(url, params, body, headers, timeout, deadline, cost)
+            except Exception as e:
+                await asyncio.sleep(self.retry_delay(url, attempts, e, deadline))
+                attempts += 1
+
+    async def attempt(self, url, params, body, headers, timeout=None, deadline=None, cost=1):
+        request = self.hedged_request if self.should_hedge(url) else self.request
+        with self.guarded(url, deadline, cost) as delay:
+            if delay > 0: await asyncio.sleep(delay)
+            return await request(url, params, body, headers, timeout, deadline)
+
+    async def hedged_request(self, url, params, body, headers, timeout=None, deadline=None):
+        pending = [asyncio.ensure_future(self.request(url, params, body, headers, timeout, deadline))]
+        if not (await asyncio.wait(pending, timeout=self.hedge_delay))[0]:
+            self.log('Hedging %s after %.2fs without a response', url, self.hedge_delay)
+            pending.append(asyncio.ensure_future(self.request(url, params, body, headers, timeout, deadline)))
+        errors = []
+        try:
+            for task in asyncio.as_completed(pending):
+                try:
+                    return await task
+                except Exception as e:
+                    errors.append(e)
+            raise errors[0]
+        finally:
+            for task in pending: task.cancel()
+
+    def require_sync(self, feature):
+        raise Error('%s is not supported by AsyncMandrill, use Mandrill instead' % feature)
+
+    def call_streaming(self, url, params, parse, timeout=None, deadline=None):
+        self.require_sync('Streaming calls')
+
+    def client_timeout(self, timeout, deadline):
+        '''Translate a requests-style timeout and a deadline to an aiohttp.ClientTimeout'''
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return aiohttp.ClientTimeout(total=remaining_time(deadline) if deadline is not None else None, sock_connect=connect, sock_read=read)
+
+    async def request(self, url, params, body, headers, timeout=None, deadline=None):
+        start = time.time()
+        async with self.get_session().post('%s%s.json' % (ROOT, url), data=body, headers=headers, timeout=self.client_timeout(timeout, deadline)) as r:
+            try:
+                remote_addr = r.connection.transport.get_extra_info('peername')[:2]
+            except:
+                remote_addr = (None, None)
+
+            response_body = await r.read()
+        return self.decode_response(url, params, r.status, response_body, remote_addr, r, time.time() - start)
+
+    async def map(self, func, items, concurrency=10, ordered=True):
+        '''Asynchronous generator counterpart of Mandrill.map, running at most concurrency calls at a time on the event loop.
+        Transport errors are yielded as aiohttp.ClientError or asyncio.TimeoutError instances, and the calls still
+        pending are cancelled if the caller stops iterating.'''
+        semaphore = asyncio.Semaphore(concurrency)
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await func(item)
+                except (Error, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    return e
+
+        pending = collections.deque()
+        try:
+            for index, item in enumerate(items):
+                pending.append((index, asyncio.ensure_future(run(item))))
+                if len(pending) >= concurrency * 2:
+                    yield await self._next_outcome(pending, ordered)
+            while pending:
+                yield await self._next_outcome(pending, ordered)
+        finally:
+            for index, task in pending: task.cancel()
+
+    async def gather(self, func, items, concurrency=10):
+        return [outcome async for outcome in self.map(func, items, concurrency)]
+
+    async def then(self, result, func):
+        return func(await result)
+
+    async def resolved(self, value):
+        return value
+
+    async def _next_outcome(self, pending, ordered):
+        if ordered:
+            outcome = await pending[0][1] # left in pending until done, to be cancelled with the rest
+            pending.popleft()
+            return outcome
+        done, _ = await asyncio.wait([task for index, task in pending], return_when=asyncio.FIRST_COMPLETED)
+        index, task = next(entry for entry in pending if entry[1] in done)
+        pending.remove((index, task))
+        return index, task.result()
+
+    async def close(self):
+        '''Close the underlying aiohttp session and its pooled connections'''
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __repr__(self):
+        return '<AsyncMandrill %s>' % self.apikey
+
 class Templates(object):
     def __init__(self, master):
         self.master = master
@@ -441,11 +2011,12 @@ class Templates(object):
         _params = {'label': label}
         return self.master.call('templates/list', _params)
 
-    def time_series(self, name):
+    def time_series(self, name, columnar=False):
         """Return the recent history (hourly stats for the last 30 days) for a template
 
         Args:
            name (string): the name of an existing template
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
 
         Returns:
            array.  the array of history information::
@@ -468,7 +2039,8 @@ class Templates(object):
            Error: A general Mandrill error has occurred
         """
         _params = {'name': name}
-        return self.master.call('templates/time-series', _params)
+        result = self.master.call('templates/time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
     def render(self, template_name, template_content, merge_vars=None):
         """Inject content and optionally merge fields into a template, returning the HTML that results
@@ -499,6 +2071,28 @@ class Templates(object):
         return self.master.call('templates/render', _params)
 
 
+    def render_local(self, template_name, template_content, merge_vars=None, merge_language='mailchimp', code=None):
+        """Render a template locally, without calling templates/render, see render_template
+
+        The template code is fetched with Templates.info, so give the client a ResponseCache to fetch it only once
+        per TTL, or pass it directly as code.
+
+        Args:
+           template_name (string): the immutable name of a template that exists in the user's account
+           template_content (array): the content to inject into the mc:edit regions, as for Templates.render
+           merge_vars (array): optional merge variables, as for Templates.render
+           merge_language (string): the merge tag language of the template, either mailchimp or handlebars
+           code (string): the template code to render instead of the published code of template_name
+
+        Returns:
+           struct.  the same as Templates.render::
+               html (string): the rendered HTML as a string
+        """
+        def render(code):
+            return {'html': render_template(code, template_content, merge_vars, merge_language)}
+        if code is not None: return self.master.then(self.master.resolved(code), render)
+        return self.master.then(self.info(template_name), lambda template: render(template['publish_code'] or template['code']))
+
 class Exports(object):
     def __init__(self, master):
         self.master = master
@@ -530,6 +2124,66 @@ for that job type.
         _params = {'id': id}
         return self.master.call('exports/info', _params)
 
+    def wait(self, id, poll_interval=5.0, max_interval=60.0, timeout=None):
+        """Poll Exports.info until an export job is complete, waiting poll_interval seconds at first and then
+        50% longer each time, up to max_interval
+
+        Args:
+           id (string): an export job identifier
+           poll_interval (float): the number of seconds to wait before the second poll
+           max_interval (float): the longest wait between two polls
+           timeout (float|None): give up after this many seconds, or at the deadline set with mandrill.timeouts if it is sooner
+
+        Returns:
+           struct.  the information about the complete export, as returned by Exports.info
+
+        Raises:
+           DeadlineExceededError: The export was not complete after timeout seconds
+           Error: The export job ended in the error or expired state
+        """
+        self.master.require_sync('Exports.wait')
+        start = time.time()
+        _, deadline = self.master.resolve_timeouts(None, timeout)
+        while True:
+            info = self.info(id)
+            if info['state'] == 'complete': return info
+            if info['state'] in ('error', 'expired'): raise Error('Export %s ended in the %s state' % (id, info['state']))
+            if deadline is not None and time.time() + poll_interval > deadline: raise DeadlineExceededError('Export %s was still %s after %.0fs' % (id, info['state'], time.time() - start))
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 1.5, max_interval)
+
+    def download(self, id, path, chunk_size=1024 * 1024, **wait_options):
+        """Wait for an export job to complete, see Exports.wait, and stream its zip archive to a file in chunks
+
+        Read its CSV content with mandrill.export_rows.  The download honours the client's timeout and the ones
+        set with mandrill.timeouts.
+
+        Args:
+           id (string): an export job identifier
+           path (string): the path of the file to write the archive to - it only appears once complete, and nothing is left behind if the download fails
+           chunk_size (integer): the number of bytes to read from the network at a time
+           wait_options: poll_interval, max_interval and timeout for Exports.wait
+
+        Returns:
+           string.  path
+        """
+        info = self.wait(id, **wait_options)
+        timeout, deadline = self.master.resolve_timeouts(None, None)
+        partial = '%s.part' % path
+        try:
+            with self.master.session.get(info['result_url'], stream=True, timeout=self.master.clip_timeout(timeout, deadline)) as r:
+                r.raise_for_status()
+                with open(partial, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size):
+                        f.write(chunk)
+                        if deadline is not None: remaining_time(deadline)
+            os.replace(partial, path)
+        except BaseException as e:
+            with contextlib.suppress(FileNotFoundError): os.remove(partial)
+            if exceeded_deadline(e, deadline): raise DeadlineExceededError('The deadline of the call was exceeded') from e
+            raise
+        return path
+
     def list(self, ):
         """Returns a list of your exports.
 
@@ -1231,11 +2885,12 @@ undo this operation, so use it carefully.
         _params = {'tag': tag}
         return self.master.call('tags/info', _params)
 
-    def time_series(self, tag):
+    def time_series(self, tag, columnar=False):
         """Return the recent history (hourly stats for the last 30 days) for a tag
 
         Args:
            tag (string): an existing tag name
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
 
         Returns:
            array.  the array of history information::
@@ -1259,11 +2914,15 @@ undo this operation, so use it carefully.
            Error: A general Mandrill error has occurred
         """
         _params = {'tag': tag}
-        return self.master.call('tags/time-series', _params)
+        result = self.master.call('tags/time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
-    def all_time_series(self, ):
+    def all_time_series(self, columnar=False):
         """Return the recent history (hourly stats for the last 30 days) for all tags
 
+        Args:
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
+
         Returns:
            array.  the array of history information::
                [] (struct): the stats for a single hour::
@@ -1285,7 +2944,8 @@ undo this operation, so use it carefully.
            Error: A general Mandrill error has occurred
         """
         _params = {}
-        return self.master.call('tags/all-time-series', _params)
+        result = self.master.call('tags/all-time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
 
 class Messages(object):
@@ -1497,6 +3157,66 @@ class Messages(object):
         _params = {'template_name': template_name, 'template_content': template_content, 'message': message, 'async': async_, 'ip_pool': ip_pool, 'send_at': send_at}
         return self.master.call('messages/send-template', _params)
 
+    def send_many(self, messages, async_=False, ip_pool=None, send_at=None, concurrency=10, ordered=True):
+        """Send many messages concurrently over the client's shared connection pool, see Messages.send
+
+        Args:
+           messages (iterable): the message structs to send, each one as accepted by Messages.send
+           async_ (boolean): passed to Messages.send for every message
+           ip_pool (string): passed to Messages.send for every message
+           send_at (string): passed to Messages.send for every message
+           concurrency (integer): the maximum number of requests in flight at any time
+           ordered (boolean): yield results in the order of messages, or as (index, result) pairs as they complete when false
+
+        Returns:
+           iterator.  yields for each message either its Messages.send result or the mandrill.Error or transport error it raised
+           - paired with the index of the message when ordered is false (an asynchronous iterator when used from an AsyncMandrill client)
+        """
+        return self.master.map(lambda message: self.send(message, async_, ip_pool, send_at), messages, concurrency, ordered)
+
+    def send_template_many(self, template_name, template_content, messages, async_=False, ip_pool=None, send_at=None, concurrency=10, ordered=True):
+        """Send many messages with the same template concurrently, see Messages.send_template and Messages.send_many
+
+        Returns:
+           iterator.  yields for each message either its Messages.send_template result or the mandrill.Error or transport error it raised
+           (an asynchronous iterator when used from an AsyncMandrill client)
+        """
+        return self.master.map(lambda message: self.send_template(template_name, template_content, message, async_, ip_pool, send_at), messages, concurrency, ordered)
+
+    def send_chunked(self, message, async_=False, ip_pool=None, send_at=None, chunk_size=1000, concurrency=4):
+        """Send a message with a large recipient list as several requests of at most chunk_size recipients, see Messages.send
+
+        Each recipient's merge_vars and recipient_metadata travel with it, and the chunks are sent concurrently.
+
+        Args:
+           message (struct): the message to send, as accepted by Messages.send - preserve_recipients is not supported
+           async_ (boolean): passed to Messages.send for every chunk
+           ip_pool (string): passed to Messages.send for every chunk
+           send_at (string): passed to Messages.send for every chunk
+           chunk_size (integer): the maximum number of recipients per request
+           concurrency (integer): the maximum number of chunks in flight at any time
+
+        Returns:
+           array.  the per-recipient results of every chunk merged in recipient order, as returned by Messages.send
+
+        Raises:
+           PartialSendError: Some of the chunks failed - the exception holds the results of the others
+        """
+        outcomes = self.master.gather(lambda chunk: self.send(chunk, async_, ip_pool, send_at), split_message(message, chunk_size), concurrency)
+        return self.master.then(outcomes, merge_results)
+
+    def send_template_chunked(self, template_name, template_content, message, async_=False, ip_pool=None, send_at=None, chunk_size=1000, concurrency=4):
+        """Send a template to a large recipient list as several requests of at most chunk_size recipients, see Messages.send_template and Messages.send_chunked
+
+        Returns:
+           array.  the per-recipient results of every chunk merged in recipient order, as returned by Messages.send_template
+
+        Raises:
+           PartialSendError: Some of the chunks failed - the exception holds the results of the others
+        """
+        outcomes = self.master.gather(lambda chunk: self.send_template(template_name, template_content, chunk, async_, ip_pool, send_at), split_message(message, chunk_size), concurrency)
+        return self.master.then(outcomes, merge_results)
+
     def search(self, query='*', date_from=None, date_to=None, tags=None, senders=None, api_keys=None, limit=100):
         """Search recently sent messages and optionally narrow by date range, tags, senders, and API keys. If no date range is specified, results within the last 7 days are returned. This method may be called up to 20 times per minute. If you need the data more often, you can use <a href="/api/docs/messages.html#method=info">/messages/info.json</a> to get the information for a single message, or <a href="http://help.mandrill.com/entries/21738186-Introduction-to-Webhooks">webhooks</a> to push activity to your own application for querying.
 
@@ -1559,7 +3279,53 @@ class Messages(object):
         _params = {'query': query, 'date_from': date_from, 'date_to': date_to, 'tags': tags, 'senders': senders, 'api_keys': api_keys, 'limit': limit}
         return self.master.call('messages/search', _params)
 
-    def search_time_series(self, query='*', date_from=None, date_to=None, tags=None, senders=None):
+    def search_all(self, query='*', date_from=None, date_to=None, tags=None, senders=None, api_keys=None, concurrency=4, limit=1000):
+        """Search sent messages like Messages.search, without its cap on the number of results
+
+        The date range is searched in slices, and every slice that returns limit results is split in two and
+        searched again, down to single days.  Slices are searched concurrently, paced by the client's rate_limiter
+        or, without one, by DEFAULT_RATE_LIMITER, so as to stay within the 20 calls per minute allowed for messages/search.
+
+        Args:
+           query (string): search terms to find matching messages, as for Messages.search
+           date_from (string): start date as YYYY-MM-DD, defaults to 7 days before date_to
+           date_to (string): end date as YYYY-MM-DD, defaults to today
+           tags (array): narrow the search as for Messages.search
+           senders (array): narrow the search as for Messages.search
+           api_keys (array): narrow the search as for Messages.search
+           concurrency (integer): the maximum number of searches in flight at any time
+           limit (integer): the number of results per call above which a slice is split
+
+        Returns:
+           iterator.  yields the matching messages as the slices complete, as returned by Messages.search, without duplicates
+        """
+        self.master.require_sync('Messages.search_all')
+        date_to = datetime.datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else datetime.datetime.utcnow().date()
+        date_from = datetime.datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else date_to - datetime.timedelta(days=7)
+        def search(first, last):
+            if self.master.rate_limiter is None: DEFAULT_RATE_LIMITER.acquire('messages/search')
+            return self.search(query, first.isoformat(), last.isoformat(), tags, senders, api_keys, limit)
+
+        seen = set()
+        with futures.ThreadPoolExecutor(concurrency) as pool:
+            pending = {submit(pool, search, date_from, date_to): (date_from, date_to)}
+            while pending:
+                for future in futures.wait(pending, return_when=futures.FIRST_COMPLETED).done:
+                    first, last = pending.pop(future)
+                    results = future.result()
+                    if len(results) >= limit:
+                        if first < last:
+                            middle = first + (last - first) // 2
+                            pending[submit(pool, search, first, middle)] = (first, middle)
+                            pending[submit(pool, search, middle + datetime.timedelta(days=1), last)] = (middle + datetime.timedelta(days=1), last)
+                            continue
+                        logger.warning('Messages.search_all got %d results for %s alone, some messages may be missing', len(results), first)
+                    for result in results:
+                        if result['_id'] not in seen:
+                            seen.add(result['_id'])
+                            yield result
+
+    def search_time_series(self, query='*', date_from=None, date_to=None, tags=None, senders=None, columnar=False):
         """Search the content of recently sent messages and return the aggregated hourly stats for matching messages
 
         Args:
@@ -1568,6 +3334,7 @@ class Messages(object):
            date_to (string): end date
            tags (array): an array of tag names to narrow the search to, will return messages that contain ANY of the tags
            senders (array): an array of sender addresses to narrow the search to, will return messages sent by ANY of the senders
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
 
         Returns:
            array.  the array of history information::
@@ -1591,7 +3358,8 @@ class Messages(object):
            Error: A general Mandrill error has occurred
         """
         _params = {'query': query, 'date_from': date_from, 'date_to': date_to, 'tags': tags, 'senders': senders}
-        return self.master.call('messages/search-time-series', _params)
+        result = self.master.call('messages/search-time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
     def info(self, id):
         """Get the information for a single recently sent message
@@ -1729,6 +3497,32 @@ class Messages(object):
         _params = {'raw_message': raw_message}
         return self.master.call('messages/parse', _params)
 
+    def content_stream(self, id, opener=None):
+        """Get the full content of a recently sent message like Messages.content, writing the content of its attachments to files as it is received
+
+        Args:
+           id (string): the unique id of the message to get
+           opener (callable): called with the kind ('attachments') and index of each attachment, returns the binary file to write its decoded content to - anonymous temporary files by default
+
+        Returns:
+           struct.  the same as Messages.content, with each attachments[].content an AttachmentFile rewound to the start of its file when possible
+        """
+        _params = {'id': id}
+        return self.master.call_streaming('messages/content', _params, lambda chunks: StreamingResultParser(chunks, opener).parse())
+
+    def parse_stream(self, raw_message, opener=None):
+        """Parse a full MIME document like Messages.parse, writing the content of its attachments and images to files as it is received
+
+        Args:
+           raw_message (string): the full MIME document of an email message
+           opener (callable): called with the kind ('attachments' or 'images') and index of each file, returns the binary file to write its content to - anonymous temporary files by default.  Must be readable and seekable when binary attachments may be received before their binary flag
+
+        Returns:
+           struct.  the same as Messages.parse, with each attachments[].content and images[].content an AttachmentFile holding the decoded content
+        """
+        _params = {'raw_message': raw_message}
+        return self.master.call_streaming('messages/parse', _params, lambda chunks: StreamingResultParser(chunks, opener, binary_flag=True).parse())
+
     def send_raw(self, raw_message, from_email=None, from_name=None, to=None, async_=False, ip_pool=None, send_at=None, return_path_domain=None):
         """Take a raw MIME document for a message, and send it exactly as if it were sent through Mandrill's SMTP servers
 
@@ -2557,11 +4351,12 @@ class Urls(object):
         _params = {'q': q}
         return self.master.call('urls/search', _params)
 
-    def time_series(self, url):
+    def time_series(self, url, columnar=False):
         """Return the recent history (hourly stats for the last 30 days) for a url
 
         Args:
            url (string): an existing URL
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
 
         Returns:
            array.  the array of history information::
@@ -2578,7 +4373,8 @@ class Urls(object):
            Error: A general Mandrill error has occurred
         """
         _params = {'url': url}
-        return self.master.call('urls/time-series', _params)
+        result = self.master.call('urls/time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
     def tracking_domains(self, ):
         """Get the list of tracking domains set up for this account
@@ -3048,11 +4844,12 @@ other Mandrill accounts from sending mail signed by your domain.
         _params = {'address': address}
         return self.master.call('senders/info', _params)
 
-    def time_series(self, address):
+    def time_series(self, address, columnar=False):
         """Return the recent history (hourly stats for the last 30 days) for a sender
 
         Args:
            address (string): the email address of the sender
+           columnar (boolean): return a mandrill.TimeSeries of NumPy arrays instead of the array of structs
 
         Returns:
            array.  the array of history information::
@@ -3075,7 +4872,8 @@ other Mandrill accounts from sending mail signed by your domain.
            Error: A general Mandrill error has occurred
         """
         _params = {'address': address}
-        return self.master.call('senders/time-series', _params)
+        result = self.master.call('senders/time-series', _params)
+        return self.master.then(result, TimeSeries.from_rows) if columnar else result
 
 
 class Metadata(object):
@@ -0,0 +1,84 @@
+import gzip, http.server, json, sys, threading, time
+import pytest
+import mandrill
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError): # clients giving up on a slow answer are expected
+            super(Server, self).handle_error(request, client_address)
+
+class StubAPI(object):
+    '''A local HTTP server standing in for the Mandrill API.
+
+    routes maps an endpoint such as users/ping to a function of the decoded params returning (status, result),
+    or None to drop the connection without answering.  A bytes result is sent as is, as an HTML page.  calls records the (url, params) of every request, and
+    headers its headers.
+    downloads maps the path of a file served by GET to its content-length and the pieces of its body - bytes
+    to send, or a number of seconds to wait before sending the next piece.
+    '''
+    def __init__(self):
+        self.routes = {'users/ping': lambda params: (200, 'PONG!')}
+        self.calls = []
+        self.headers = []
+        self.downloads = {}
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['content-length']))
+                if self.headers.get('content-encoding') == 'gzip': body = gzip.decompress(body)
+                url = self.path[len('/api/1.0/'):-len('.json')]
+                params = json.loads(body)
+                stub.calls.append((url, params))
+                stub.headers.append(dict((name.lower(), value) for name, value in self.headers.items()))
+                response = stub.routes[url](params)
+                if response is None:
+                    self.close_connection = True
+                    return
+                status, result = response
+                html = isinstance(result, bytes)
+                data = result if html else json.dumps(result).encode('utf-8')
+                self.send_response(status)
+                self.send_header('content-type', 'text/html' if html else 'application/json')
+                self.send_header('content-length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                length, pieces = stub.downloads[self.path]
+                self.send_response(200)
+                self.send_header('content-length', str(length))
+                self.end_headers()
+                for piece in pieces:
+                    if isinstance(piece, bytes):
+                        self.wfile.write(piece)
+                        self.wfile.flush()
+                    else:
+                        time.sleep(piece)
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.base = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.root = self.base + '/api/1.0/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def urls(self):
+        return [url for url, params in self.calls]
+
+@pytest.fixture
+def api(monkeypatch):
+    stub = StubAPI()
+    stub.thread.start()
+    monkeypatch.setattr(mandrill, 'ROOT', stub.root)
+    monkeypatch.delenv('MANDRILL_CACHE_DIR', raising=False)
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
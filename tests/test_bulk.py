@@ -0,0 +1,112 @@
+import asyncio, datetime, time
+import pytest, requests
+import mandrill
+
+def send(params):
+    email = params['message']['to'][0]['email']
+    if email.startswith('drop'): return None
+    if email.startswith('invalid'): return 500, {'status': 'error', 'name': 'ValidationError', 'message': 'Invalid recipient'}
+    return 200, [{'email': recipient['email'], 'status': 'sent'} for recipient in params['message']['to']]
+
+def message(email):
+    return {'subject': 'Hello', 'text': 'Hello', 'from_email': 'sender@example.com', 'to': [{'email': email}]}
+
+def test_send_many_yields_errors_in_place(api):
+    api.routes['messages/send'] = send
+    m = mandrill.Mandrill('key')
+    emails = ['a@example.com', 'invalid@example.com', 'drop@example.com', 'b@example.com']
+    outcomes = list(m.messages.send_many([message(email) for email in emails], concurrency=2))
+    assert outcomes[0] == [{'email': 'a@example.com', 'status': 'sent'}]
+    assert isinstance(outcomes[1], mandrill.ValidationError)
+    assert isinstance(outcomes[2], requests.ConnectionError)
+    assert outcomes[3] == [{'email': 'b@example.com', 'status': 'sent'}]
+
+def test_send_chunked_reports_failed_chunks(api):
+    api.routes['messages/send'] = send
+    m = mandrill.Mandrill('key')
+    msg = message('a@example.com')
+    msg['to'] = [{'email': email} for email in ('a@example.com', 'drop@example.com', 'b@example.com')]
+    with pytest.raises(mandrill.PartialSendError) as info:
+        m.messages.send_chunked(msg, chunk_size=1)
+    assert [result['email'] for result in info.value.results] == ['a@example.com', 'b@example.com']
+    assert len(info.value.errors) == 1 and isinstance(info.value.errors[0], requests.ConnectionError)
+
+def test_async_send_many_yields_errors_in_place(api):
+    api.routes['messages/send'] = send
+    async def main():
+        async with mandrill.AsyncMandrill('key') as m:
+            emails = ['a@example.com', 'drop@example.com', 'invalid@example.com']
+            return [outcome async for outcome in m.messages.send_many([message(email) for email in emails])]
+    outcomes = asyncio.run(main())
+    assert outcomes[0] == [{'email': 'a@example.com', 'status': 'sent'}]
+    assert isinstance(outcomes[1], mandrill.aiohttp.ClientError)
+    assert isinstance(outcomes[2], mandrill.ValidationError)
+
+class RecordingRateLimiter(mandrill.RateLimiter):
+    def __init__(self):
+        super(RecordingRateLimiter, self).__init__()
+        self.acquired = []
+
+    def reserve(self, url, cost=1):
+        self.acquired.append(url)
+        return super(RecordingRateLimiter, self).reserve(url, cost)
+
+def search(params):
+    first, last = (datetime.date.fromisoformat(params[key]) for key in ('date_from', 'date_to'))
+    days = [first + datetime.timedelta(days=i) for i in range((last - first).days + 1)]
+    results = [{'_id': '%s-%d' % (day, i), 'ts': day.isoformat()} for day in days for i in range(2)]
+    return 200, results[:params['limit']] + [{'_id': 'everywhere'}]
+
+@pytest.mark.parametrize('own_limiter', [False, True])
+def test_search_all_splits_and_paces_the_searches(api, monkeypatch, own_limiter):
+    api.routes['messages/search'] = search
+    default, limiter = RecordingRateLimiter(), RecordingRateLimiter()
+    monkeypatch.setattr(mandrill, 'DEFAULT_RATE_LIMITER', default)
+    m = mandrill.Mandrill('key', rate_limiter=limiter if own_limiter else None)
+    results = list(m.messages.search_all(date_from='2026-10-01', date_to='2026-10-08', limit=5))
+    assert sorted(result['_id'] for result in results) == sorted(['%s-%d' % (datetime.date(2026, 10, 1 + day), i) for day in range(8) for i in range(2)] + ['everywhere'])
+    searches = api.urls().count('messages/search')
+    assert searches > 1
+    assert (len(default.acquired), len(limiter.acquired)) == ((0, searches) if own_limiter else (searches, 0))
+
+def test_workers_run_within_the_callers_timeouts(api):
+    api.routes['messages/send'] = lambda params: time.sleep(0.5) or send(params)
+    api.routes['messages/search'] = lambda params: time.sleep(0.5) or search(params)
+    m = mandrill.Mandrill('key')
+    start = time.time()
+    with mandrill.timeouts(deadline=0.1):
+        outcomes = list(m.messages.send_many([message('a@example.com'), message('b@example.com')]))
+        assert all(isinstance(outcome, mandrill.DeadlineExceededError) for outcome in outcomes)
+        with pytest.raises(mandrill.DeadlineExceededError):
+            list(m.messages.search_all(date_from='2026-10-01', date_to='2026-10-08'))
+    assert time.time() - start < 0.45
+
+def test_unordered_send_many_yields_indices(api):
+    api.routes['messages/send'] = send
+    emails = ['a@example.com', 'invalid@example.com', 'drop@example.com', 'b@example.com']
+    m = mandrill.Mandrill('key')
+    outcomes = dict(m.messages.send_many([message(email) for email in emails], concurrency=2, ordered=False))
+    async def main():
+        async with mandrill.AsyncMandrill('key') as m:
+            return dict([pair async for pair in m.messages.send_many([message(email) for email in emails], ordered=False)])
+    for outcomes, transport_error in ((outcomes, requests.ConnectionError), (asyncio.run(main()), mandrill.aiohttp.ClientError)):
+        assert sorted(outcomes) == [0, 1, 2, 3]
+        assert outcomes[0] == [{'email': 'a@example.com', 'status': 'sent'}] and outcomes[3] == [{'email': 'b@example.com', 'status': 'sent'}]
+        assert isinstance(outcomes[1], mandrill.ValidationError) and isinstance(outcomes[2], transport_error)
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_async_map_cancels_pending_calls_when_the_caller_stops(ordered):
+    finished = []
+    async def work(i):
+        await asyncio.sleep(0.2 if i else 0)
+        finished.append(i)
+        return i
+    async def main():
+        async with mandrill.AsyncMandrill('key') as m:
+            outcomes = m.map(work, range(6), ordered=ordered)
+            first = await outcomes.__anext__()
+            await outcomes.aclose()
+            await asyncio.sleep(0.4)
+            return first
+    assert asyncio.run(main()) == (0 if ordered else (0, 0))
+    assert finished == [0]
@@ -0,0 +1,118 @@
+import asyncio, tempfile
+import pytest
+import mandrill
+
+def flaky(failures):
+    '''A users/ping route failing with ServiceUnavailable the first failures times'''
+    calls = []
+    def ping(params):
+        calls.append(params)
+        if len(calls) <= failures: return 500, {'status': 'error', 'name': 'ServiceUnavailable', 'message': 'Try again'}
+        return 200, 'PONG!'
+    return ping
+
+def template_routes(api):
+    versions = {'welcome': 1}
+    api.routes['templates/info'] = lambda params: (200, {'name': params['name'], 'version': versions[params['name']]})
+    def update(params):
+        versions[params['name']] += 1
+        return 200, {'name': params['name'], 'version': versions[params['name']]}
+    api.routes['templates/update'] = update
+
+@pytest.fixture(params=['memory', 'disk'])
+def cache(request):
+    if request.param == 'memory':
+        yield mandrill.ResponseCache()
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            yield mandrill.DiskCache(directory)
+
+def test_cache_and_invalidation(api, cache):
+    template_routes(api)
+    m = mandrill.Mandrill('key', cache=cache)
+    assert m.templates.info('welcome')['version'] == 1
+    assert m.templates.info('welcome')['version'] == 1
+    assert api.urls() == ['templates/info']
+    m.templates.update('welcome', code='<p>new</p>')
+    assert m.templates.info('welcome')['version'] == 2
+    assert api.urls() == ['templates/info', 'templates/update', 'templates/info']
+
+def test_async_cache_and_invalidation(api, cache):
+    template_routes(api)
+    async def main():
+        async with mandrill.AsyncMandrill('key', cache=cache) as m:
+            versions = [(await m.templates.info('welcome'))['version'], (await m.templates.info('welcome'))['version']]
+            await m.templates.update('welcome', code='<p>new</p>')
+            return versions + [(await m.templates.info('welcome'))['version']]
+    assert asyncio.run(main()) == [1, 1, 2]
+    assert api.urls() == ['templates/info', 'templates/update', 'templates/info']
+
+def test_retry(api):
+    api.routes['users/ping'] = flaky(2)
+    m = mandrill.Mandrill('key', retry=mandrill.RetryPolicy(backoff=0.01))
+    assert m.users.ping() == 'PONG!'
+    assert len(api.calls) == 3
+    api.routes['users/ping'] = flaky(3)
+    with pytest.raises(mandrill.ServiceUnavailableError):
+        m.users.ping()
+
+def test_async_retry(api):
+    api.routes['users/ping'] = flaky(2)
+    async def main():
+        async with mandrill.AsyncMandrill('key', retry=mandrill.RetryPolicy(backoff=0.01)) as m:
+            assert await m.users.ping() == 'PONG!'
+            api.routes['users/ping'] = flaky(3)
+            with pytest.raises(mandrill.ServiceUnavailableError):
+                await m.users.ping()
+    asyncio.run(main())
+    assert len(api.calls) == 6
+
+BAD_GATEWAY = b'<html><head><title>502 Bad Gateway</title></head><body><h1>502 Bad Gateway</h1></body></html>'
+
+def html_page(status, failures):
+    calls = []
+    def route(params):
+        calls.append(params)
+        return (status, BAD_GATEWAY) if len(calls) <= failures else (200, 'PONG!')
+    return route
+
+def test_html_error_pages(api):
+    api.routes['users/ping'] = html_page(502, 2)
+    m = mandrill.Mandrill('key', retry=mandrill.RetryPolicy(backoff=0.01))
+    assert m.users.ping() == 'PONG!'
+    assert len(api.calls) == 3
+    api.routes['users/ping'] = html_page(502, 3)
+    with pytest.raises(mandrill.UnexpectedResponseError) as info:
+        m.users.ping()
+    assert info.value.status_code == 502 and '502 Bad Gateway' in str(info.value)
+    assert len(api.calls) == 6
+    api.routes['users/ping'] = html_page(403, 1)
+    with pytest.raises(mandrill.UnexpectedResponseError) as info:
+        m.users.ping()
+    assert info.value.status_code == 403
+    assert len(api.calls) == 7
+
+def test_async_html_error_pages(api):
+    api.routes['users/ping'] = html_page(502, 2)
+    async def main():
+        async with mandrill.AsyncMandrill('key', retry=mandrill.RetryPolicy(backoff=0.01)) as m:
+            assert await m.users.ping() == 'PONG!'
+            api.routes['users/ping'] = html_page(403, 1)
+            with pytest.raises(mandrill.UnexpectedResponseError) as info:
+                await m.users.ping()
+            assert info.value.status_code == 403
+    asyncio.run(main())
+    assert len(api.calls) == 4
+
+def test_sends_are_never_retried(api):
+    api.routes['messages/send'] = lambda params: (500, {'status': 'error', 'name': 'ServiceUnavailable', 'message': 'Try again'})
+    m = mandrill.Mandrill('key', retry=mandrill.RetryPolicy(backoff=0.01))
+    with pytest.raises(mandrill.ServiceUnavailableError):
+        m.messages.send({'to': [{'email': 'a@example.com'}]})
+    assert api.urls() == ['messages/send']
+
+def test_disk_caches_created_concurrently(monkeypatch):
+    with tempfile.TemporaryDirectory() as directory:
+        monkeypatch.setenv('MANDRILL_CACHE_DIR', directory + '/mandrill')
+        caches = mandrill.Mandrill('key').gather(lambda i: mandrill.DiskCache(), range(8), 8)
+        assert all(isinstance(cache, mandrill.DiskCache) for cache in caches)
@@ -0,0 +1,95 @@
+import asyncio, base64, json, logging, os, time
+import pytest
+import mandrill
+
+def test_last_request_bodies_are_text(api):
+    api.routes['tags/info'] = lambda params: (200, {'tag': params['tag']})
+    m = mandrill.Mandrill('key')
+    m.tags.info('päivää')
+    assert isinstance(m.last_request['request_body'], str)
+    assert json.loads(m.last_request['request_body'])['tag'] == 'päivää'
+    assert json.loads(m.last_request['response_body']) == {'tag': 'päivää'}
+    slim = mandrill.Mandrill('key', keep_last_request='slim')
+    slim.tags.info('päivää')
+    assert 'request_body' not in slim.last_request and slim.last_request['response_size'] > 0
+
+class ReversingCodec(object):
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        result = json.loads(data)
+        return result[::-1] if isinstance(result, str) else result
+
+PARAMS = {'message': {'metadata': {1: 'a'}, 'text': 'päivää'}}
+
+def test_codecs(api):
+    assert mandrill.Mandrill('key').codec is mandrill.DEFAULT_CODEC is mandrill.CODECS[mandrill.json.__name__]
+    assert mandrill.Mandrill('key', codec='json').codec is mandrill.CODECS['json']
+    with pytest.raises(mandrill.Error):
+        mandrill.Mandrill('key', codec='yaml')
+    assert json.loads(mandrill.DEFAULT_CODEC.encode(PARAMS)) == json.loads(json.dumps(PARAMS))
+    assert mandrill.Mandrill('key', codec=ReversingCodec()).users.ping() == '!GNOP'
+
+def test_orjson_codec(api):
+    pytest.importorskip('orjson')
+    codec = mandrill.CODECS['orjson']
+    assert codec.decode(codec.encode(PARAMS)) == json.loads(json.dumps(PARAMS))
+    with pytest.raises(TypeError):
+        codec.encode({'big': 2 ** 70})
+    api.routes['tags/info'] = lambda params: (200, {'tag': params['tag']})
+    assert mandrill.Mandrill('key', codec='orjson').tags.info('päivää') == {'tag': 'päivää'}
+
+@pytest.mark.parametrize('client', ['sync', 'async'])
+def test_compress_threshold(api, client):
+    api.routes['tags/info'] = lambda params: (200, {'tag': params['tag']})
+    tags = ['small', 'large ' + 'päivää' * 1000]
+    if client == 'sync':
+        m = mandrill.Mandrill('key', compress_threshold=1024)
+        results = [m.tags.info(tag) for tag in tags]
+    else:
+        async def main():
+            async with mandrill.AsyncMandrill('key', compress_threshold=1024) as m:
+                return [await m.tags.info(tag) for tag in tags]
+        results = asyncio.run(main())
+    assert results == [{'tag': tag} for tag in tags]
+    assert [params['tag'] for url, params in api.calls] == tags
+    assert [headers.get('content-encoding') for headers in api.headers] == [None, 'gzip']
+    assert int(api.headers[1]['content-length']) < 1024
+
+def test_bodies_are_only_formatted_for_an_enabled_logger(api, monkeypatch, caplog):
+    api.routes['tags/info'] = lambda params: (200, {'tag': params['tag'], 'padding': 'x' * 100})
+    formatted = []
+    log_body = mandrill.Mandrill.log_body
+    monkeypatch.setattr(mandrill.Mandrill, 'log_body', lambda self, body: formatted.append(body) or log_body(self, body))
+    mandrill.Mandrill('key').tags.info('quiet')
+    assert formatted == []
+    caplog.set_level(logging.INFO, logger='mandrill')
+    mandrill.Mandrill('key', debug=True, log_body_limit=20).tags.info('loud')
+    assert len(formatted) == 2
+    request, response = [record.getMessage() for record in caplog.records if record.name == 'mandrill']
+    assert request.endswith('.json: ' + mandrill.DEFAULT_CODEC.encode({'tag': 'loud', 'key': 'key'}).decode('utf-8')[:20] + '... (%d characters)' % len(formatted[0]))
+    assert response.endswith(': {"tag": "loud", "pad... (%d characters)' % len(formatted[1]))
+
+def test_log_overhead_benchmark_5mb_attachment():
+    attachment = {'type': 'application/pdf', 'name': 'report.pdf', 'content': base64.b64encode(os.urandom(5 * 1024 * 1024 * 3 // 4)).decode('ascii')}
+    m = mandrill.Mandrill('key')
+    response = json.dumps([{'email': 'a@example.com', 'status': 'sent', '_id': 'abc'}]).encode('utf-8')
+    def call():
+        params = m.encode_params('messages/send', {'message': {'to': [{'email': 'a@example.com'}], 'attachments': [attachment]}})
+        m.decode_response('messages/send', params, 200, response, (None, None), None, 0.0)
+        return params
+    def eager_call(): # what call did before: format both log messages whether the logger is enabled or not
+        params = call()
+        'POST to %s%s.json: %s' % (mandrill.ROOT, 'messages/send', params.decode('utf-8'))
+        'Received %s in %.2fms: %s' % (200, 0.0, response.decode('utf-8'))
+    def best(func):
+        times = []
+        for i in range(5):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        return min(times)
+    before, after = best(eager_call), best(call)
+    print('5 MB attachment, logger disabled: %.1fms per call with eager formatting, %.1fms lazily' % (before * 1000, after * 1000))
+    assert after < before
@@ -0,0 +1,83 @@
+import asyncio, collections, csv, datetime, io, os, subprocess, sys, tempfile, zipfile
+import numpy, pytest
+import mandrill
+
+HEADER = ['Date', 'Email Address', 'Sender', 'Subject', 'Status', 'Tags', 'Subaccount', 'Opens', 'Clicks', 'Bounce Detail', 'customer_id']
+ROWS = [
+    ['2026-10-01 10:00:00', 'a@example.com', 'news@example.com', 'Hi', 'sent', 'weekly,promo', '', '2', '1', '', '17'],
+    ['2026-10-01 10:05:00', 'b@example.com', 'news@example.com', 'Hi', 'bounced', 'weekly', '', '', '', 'bad mailbox', ''],
+    ['2026-10-01 11:00:00', 'c@example.com', 'billing@example.com', 'Invoice', 'sent', '', 'acme', '1', '0', '', '18'],
+    ['2026-10-02 09:00:00', 'd@example.com', 'news@example.com', 'Hi, "you"', 'soft-bounced', 'promo', '', '0', '0', 'full', ''],
+    ['2026-10-02 09:30:00', 'e@example.com', 'billing@example.com', 'Invoice', 'rejected', 'promo,weekly', 'acme', '5', '3', '', '19'],
+]
+
+@pytest.fixture(scope='module')
+def export():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'activity.zip')
+        data = io.StringIO()
+        csv.writer(data).writerows([HEADER] + ROWS)
+        with zipfile.ZipFile(path, 'w') as f:
+            f.writestr('activity.csv', data.getvalue())
+        yield path
+
+def expected_stats(path, by):
+    stats = collections.defaultdict(lambda: {'sent': 0, 'opens': 0, 'clicks': 0, 'bounces': 0})
+    for row in mandrill.export_rows(path):
+        keys = [tag for tag in row['Tags'].split(',') if tag] if by == 'tags' else [row[by.capitalize()]]
+        for key in keys:
+            stats[key]['sent'] += 1
+            stats[key]['opens'] += int(row['Opens'] or 0)
+            stats[key]['clicks'] += int(row['Clicks'] or 0)
+            stats[key]['bounces'] += row['Status'] in mandrill.BOUNCE_STATUSES
+    return dict(stats)
+
+def test_import_does_not_load_optional_packages():
+    code = 'import sys, mandrill; print(sorted(set(("numpy", "aiohttp", "asyncio")) & set(sys.modules)))'
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).strip() == b'[]'
+
+@pytest.mark.parametrize('by', ['sender', 'status', 'subaccount', 'tags'])
+@pytest.mark.parametrize('batch_size', [1, 2, 100000])
+def test_activity_stats(export, by, batch_size):
+    assert mandrill.activity_stats(export, by, batch_size) == expected_stats(export, by)
+
+def test_load_activity(export):
+    activity = mandrill.load_activity(export, batch_size=2)
+    assert len(activity) == len(ROWS)
+    assert activity['date'].dtype == numpy.dtype('datetime64[s]') and str(activity['date'][3]) == '2026-10-02T09:00:00'
+    assert list(activity.decode('sender')) == [row[2] for row in ROWS]
+    assert list(activity['opens']) == [2, 0, 1, 0, 5]
+    assert list(activity['customer_id']) == [row[10] for row in ROWS]
+    assert [(int(row), activity.categories['tags'].values[code]) for row, code in zip(activity.tag_rows, activity.tag_codes)] == [
+        (0, 'weekly'), (0, 'promo'), (1, 'weekly'), (3, 'promo'), (4, 'promo'), (4, 'weekly')]
+
+def hourly(start, hours, **metrics):
+    return [dict({'time': (start + datetime.timedelta(hours=hour)).strftime('%Y-%m-%d %H:%M:%S')}, **dict((name, value(hour)) for name, value in metrics.items())) for hour in range(hours)]
+
+def test_time_series():
+    rows = hourly(datetime.datetime(2026, 10, 3), 24 * 10, sent=lambda hour: 10, hard_bounces=lambda hour: hour % 2, unique_clicks=lambda hour: None)
+    series = mandrill.TimeSeries.from_rows(rows)
+    assert len(series) == 240 and series['time'].dtype == numpy.dtype('datetime64[h]')
+    assert series['sent'].dtype == numpy.int64 and series['unique_clicks'].sum() == 0
+    days = series.resample('D')
+    assert [str(day) for day in days.time[:2]] == ['2026-10-03', '2026-10-04'] and list(days['sent'][:2]) == [240, 240]
+    weeks = series.resample('W')
+    assert [str(week) for week in weeks.time] == ['2026-09-28', '2026-10-05', '2026-10-12'] # Mondays
+    assert list(weeks['sent']) == [2 * 240, 7 * 240, 1 * 240]
+    assert list(days.rate('hard_bounces')[:2]) == [0.05, 0.05]
+    assert numpy.isnan(mandrill.TimeSeries.from_rows(hourly(datetime.datetime(2026, 10, 3), 2, sent=lambda hour: 0, opens=lambda hour: 0)).rate('opens')).all()
+    assert len(mandrill.TimeSeries.from_rows([])) == 0
+    with pytest.raises(mandrill.Error):
+        series.resample('M')
+
+def test_columnar_time_series_endpoints(api):
+    rows = hourly(datetime.datetime(2026, 10, 3), 48, sent=lambda hour: 1, clicks=lambda hour: 2, unique_clicks=lambda hour: 1)
+    api.routes['urls/time-series'] = lambda params: (200, rows)
+    api.routes['tags/all-time-series'] = lambda params: (200, rows)
+    m = mandrill.Mandrill('key')
+    assert m.urls.time_series('https://example.com') == rows
+    assert list(m.urls.time_series('https://example.com', columnar=True).resample('D')['clicks']) == [48, 48]
+    async def main():
+        async with mandrill.AsyncMandrill('key') as m:
+            return await m.tags.all_time_series(columnar=True)
+    assert list(asyncio.run(main())['unique_clicks']) == [1] * 48
@@ -0,0 +1,59 @@
+import io, os, tempfile, zipfile
+import pytest, requests
+import mandrill
+
+def export_routes(api, states=('working', 'complete')):
+    states = list(states)
+    api.routes['exports/info'] = lambda params: (200, {'id': params['id'], 'state': states.pop(0) if len(states) > 1 else states[0], 'result_url': api.base + '/exports/%s.zip' % params['id']})
+
+def archive(rows):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as f:
+        f.writestr('activity.csv', '\n'.join(','.join(row) for row in rows) + '\n')
+    return data.getvalue()
+
+@pytest.fixture
+def directory():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+def test_wait_and_download(api, directory):
+    export_routes(api, ('waiting', 'working', 'complete'))
+    data = archive([('Date', 'Email Address'), ('2026-10-01 10:00:00', 'a@example.com'), ('2026-10-01 11:00:00', 'ü@example.com')])
+    api.downloads['/exports/abc.zip'] = (len(data), [data[:10], 0.01, data[10:]])
+    m = mandrill.Mandrill('key')
+    path = os.path.join(directory, 'export.zip')
+    assert m.exports.download('abc', path, chunk_size=7, poll_interval=0.01) == path
+    assert api.urls() == ['exports/info'] * 3
+    assert os.listdir(directory) == ['export.zip']
+    assert list(mandrill.export_rows(path)) == [{'Date': '2026-10-01 10:00:00', 'Email Address': 'a@example.com'}, {'Date': '2026-10-01 11:00:00', 'Email Address': 'ü@example.com'}]
+
+def test_wait_gives_up(api):
+    export_routes(api, ('working',))
+    m = mandrill.Mandrill('key')
+    with pytest.raises(mandrill.DeadlineExceededError):
+        m.exports.wait('abc', poll_interval=0.05, timeout=0.2)
+    with pytest.raises(mandrill.DeadlineExceededError):
+        with mandrill.timeouts(deadline=0.2):
+            m.exports.wait('abc', poll_interval=0.05, timeout=10)
+    export_routes(api, ('expired',))
+    with pytest.raises(mandrill.Error):
+        m.exports.wait('abc')
+
+def test_interrupted_download_leaves_nothing_behind(api, directory):
+    export_routes(api, ('complete',))
+    api.downloads['/exports/abc.zip'] = (1000, [b'x' * 100])
+    m = mandrill.Mandrill('key')
+    with pytest.raises(requests.RequestException):
+        m.exports.download('abc', os.path.join(directory, 'export.zip'))
+    assert os.listdir(directory) == []
+
+@pytest.mark.parametrize('pieces', [[b'x' * 100, 1.0, b'x' * 900], [b'x' * 100, 0.1, b'x' * 100, 0.1, b'x' * 100, 0.1, b'x' * 100, 0.1, b'x' * 600]])
+def test_download_honours_the_deadline(api, directory, pieces):
+    export_routes(api, ('complete',))
+    api.downloads['/exports/abc.zip'] = (1000, pieces)
+    m = mandrill.Mandrill('key')
+    with pytest.raises(mandrill.DeadlineExceededError):
+        with mandrill.timeouts(deadline=0.25):
+            m.exports.download('abc', os.path.join(directory, 'export.zip'), chunk_size=10)
+    assert os.listdir(directory) == []
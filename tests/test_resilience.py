@@ -0,0 +1,196 @@
+import asyncio, os, tempfile, time
+import pytest, requests
+import mandrill
+
+def test_rate_limiter_paces_calls_per_endpoint():
+    limiter = mandrill.RateLimiter([('messages/search', 2, 1.0)])
+    assert [limiter.reserve('messages/search') for i in range(2)] == [0, 0]
+    assert 0.45 < limiter.reserve('messages/search') <= 0.5
+    assert limiter.reserve('messages/info') == 0
+
+def test_send_rate_takes_a_token_per_recipient():
+    limiter = mandrill.RateLimiter(send_rate=10)
+    message = {'to': [{'email': 'user%d@example.com' % i} for i in range(30)]}
+    assert limiter.cost('messages/send', {'message': message}) == 30
+    assert limiter.cost('messages/send-template', {'template_name': 'welcome', 'message': message}) == 30
+    assert limiter.cost('messages/send-raw', {'raw_message': '...', 'to': ['a@example.com', 'b@example.com']}) == 2
+    assert limiter.cost('messages/send-raw', {'raw_message': '...'}) == 1
+    assert limiter.cost('messages/search', {'query': '*'}) == 1
+    assert limiter.reserve('messages/send', 10) == 0
+    assert 1.95 < limiter.reserve('messages/send', 20) <= 2.0
+
+def test_shared_rate_limiter_shares_the_budget():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'limits')
+        first = mandrill.SharedRateLimiter(path, send_rate=10)
+        second = mandrill.SharedRateLimiter(path, send_rate=10)
+        assert first.reserve('messages/send', 10) == 0
+        assert second.reserve('messages/send', 5) > 0.45
+        first.close()
+        second.close()
+
+def test_client_charges_sends_per_recipient(api):
+    api.routes['messages/send'] = lambda params: (200, [{'email': recipient['email'], 'status': 'sent'} for recipient in params['message']['to']])
+    limiter = mandrill.RateLimiter(send_rate=1000)
+    m = mandrill.Mandrill('key', rate_limiter=limiter)
+    m.messages.send({'to': [{'email': 'user%d@example.com' % i} for i in range(50)]})
+    tokens, last = limiter.state[limiter.send_bucket]
+    assert 949 < tokens <= 950.5
+
+def open_circuit(breaker, url):
+    for i in range(breaker.min_calls):
+        breaker.before(url)
+        breaker.record(url, 0.0, mandrill.ServiceUnavailableError('down'))
+    assert breaker.state(url.split('/')[0]) == 'open'
+
+def test_circuit_breaker_opens_probes_and_closes():
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=0.0)
+    open_circuit(breaker, 'messages/info')
+    probe = breaker.before('messages/info')
+    assert breaker.state('messages') == 'half-open'
+    with pytest.raises(mandrill.CircuitOpenError):
+        breaker.before('messages/content')
+    breaker.record('messages/info', 0.0, probe=probe)
+    assert breaker.state() == {'messages': 'closed'}
+
+def test_only_probes_settle_a_half_open_circuit():
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=0.0, probes=2)
+    early = [breaker.before('messages/info') for i in range(2)]
+    assert early == [None, None]
+    open_circuit(breaker, 'messages/info')
+    first, second = breaker.before('messages/info'), breaker.before('messages/info')
+    breaker.record('messages/info', 0.0, probe=early[0]) # started while the circuit was closed
+    breaker.release('messages/info', early[1])
+    assert breaker.state('messages') == 'half-open'
+    with pytest.raises(mandrill.CircuitOpenError):
+        breaker.before('messages/info')
+    breaker.record('messages/info', 0.0, mandrill.ServiceUnavailableError('down'), first)
+    assert breaker.state('messages') == 'open'
+    third = breaker.before('messages/info')
+    breaker.record('messages/info', 0.0, probe=second) # a probe of the previous half-open state
+    assert breaker.state('messages') == 'half-open'
+    breaker.record('messages/info', 0.0, probe=third)
+    assert breaker.state('messages') == 'closed'
+
+def test_open_circuit_takes_no_tokens(api):
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=60.0)
+    open_circuit(breaker, 'messages/info')
+    limiter = mandrill.RateLimiter([('messages/*', 1, 60.0)])
+    m = mandrill.Mandrill('key', rate_limiter=limiter, circuit_breaker=breaker)
+    start = time.time()
+    for i in range(3):
+        with pytest.raises(mandrill.CircuitOpenError):
+            m.messages.info('abc')
+    assert time.time() - start < 0.1
+    assert limiter.reserve('messages/info') == 0
+
+def test_cancelled_probe_releases_the_circuit(api):
+    api.routes['messages/info'] = lambda params: time.sleep(1) or (200, {'_id': params['id']})
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=0.0)
+    open_circuit(breaker, 'messages/info')
+    async def main():
+        async with mandrill.AsyncMandrill('key', circuit_breaker=breaker) as m:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(m.messages.info('first'), 0.1)
+            assert breaker.state('messages') == 'half-open'
+            api.routes['messages/info'] = lambda params: (200, {'_id': params['id']})
+            return await m.messages.info('second')
+    assert asyncio.run(main()) == {'_id': 'second'}
+    assert breaker.state('messages') == 'closed'
+
+def test_interrupted_probe_releases_the_circuit(api):
+    def interrupt(*args):
+        raise KeyboardInterrupt
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=0.0)
+    open_circuit(breaker, 'messages/info')
+    m = mandrill.Mandrill('key', circuit_breaker=breaker)
+    m.request = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        m.messages.info('first')
+    del m.request
+    api.routes['messages/info'] = lambda params: (200, {'_id': params['id']})
+    assert m.messages.info('second') == {'_id': 'second'}
+    assert breaker.state('messages') == 'closed'
+
+def slow_ping(params):
+    time.sleep(0.5)
+    return 200, 'PONG!'
+
+def test_deadline_during_a_request(api):
+    api.routes['users/ping'] = slow_ping
+    m = mandrill.Mandrill('key', retry=mandrill.RetryPolicy())
+    with pytest.raises(mandrill.DeadlineExceededError):
+        with mandrill.timeouts(deadline=0.2):
+            m.users.ping()
+    with pytest.raises(requests.Timeout):
+        m.call('users/ping', timeout=0.2)
+    with pytest.raises(mandrill.DeadlineExceededError):
+        m.call('users/ping', timeout=5, deadline=0.2)
+
+def test_deadline_during_an_async_request(api):
+    api.routes['users/ping'] = slow_ping
+    async def main():
+        async with mandrill.AsyncMandrill('key', retry=mandrill.RetryPolicy()) as m:
+            with pytest.raises(mandrill.DeadlineExceededError):
+                with mandrill.timeouts(deadline=0.2):
+                    await m.users.ping()
+            with pytest.raises(asyncio.TimeoutError):
+                await m.call('users/ping', timeout=0.2)
+    asyncio.run(main())
+
+def test_hedged_request_returns_the_first_response(api):
+    calls = []
+    def info(params):
+        calls.append(params['id'])
+        if len(calls) == 1: time.sleep(1)
+        return 200, {'_id': params['id'], 'attempt': len(calls)}
+    api.routes['messages/info'] = info
+    m = mandrill.Mandrill('key', hedge_delay=0.1)
+    start = time.time()
+    assert m.messages.info('abc') == {'_id': 'abc', 'attempt': 2}
+    assert time.time() - start < 0.8
+    assert calls == ['abc', 'abc']
+    assert m.messages.info('def')['attempt'] == 3 # answered before the hedge delay, no hedge
+    assert calls == ['abc', 'abc', 'def']
+
+def test_queued_hedged_requests_are_not_hedged(api):
+    def info(params):
+        time.sleep(0.15)
+        return 200, {'_id': params['id']}
+    api.routes['messages/info'] = info
+    m = mandrill.Mandrill('key', hedge_delay=0.3, pool_maxsize=2)
+    results = m.gather(lambda i: m.messages.info(str(i)), range(8), concurrency=8)
+    assert sorted(result['_id'] for result in results) == [str(i) for i in range(8)]
+    assert len(api.calls) == 8
+
+@pytest.mark.parametrize('deadline', [1e-6, 0.2])
+def test_deadline_does_not_settle_a_probe(api, deadline):
+    api.routes['messages/info'] = api.routes['messages/content'] = lambda params: time.sleep(0.5) or (200, {'_id': params['id']})
+    breaker = mandrill.CircuitBreaker(min_calls=4, window=4, reset_timeout=0.0)
+    open_circuit(breaker, 'messages/info')
+    m = mandrill.Mandrill('key', circuit_breaker=breaker)
+    with pytest.raises(mandrill.DeadlineExceededError):
+        m.call('messages/info', {'id': 'first'}, deadline=deadline)
+    with pytest.raises(mandrill.DeadlineExceededError):
+        m.call_streaming('messages/content', {'id': 'first'}, list, deadline=deadline)
+    async def main():
+        async with mandrill.AsyncMandrill('key', circuit_breaker=breaker) as m:
+            with pytest.raises(mandrill.DeadlineExceededError):
+                await m.call('messages/info', {'id': 'first'}, deadline=deadline)
+    asyncio.run(main())
+    assert breaker.state('messages') == ('open' if deadline < 0.01 else 'half-open') # neither closed nor tripped again
+    api.routes['messages/info'] = lambda params: (200, {'_id': params['id']})
+    assert m.messages.info('second') == {'_id': 'second'}
+    assert breaker.state('messages') == 'closed'
+
+def test_hedged_requests_report_their_own_last_request(api):
+    api.routes['messages/info'] = lambda params: (200, {'_id': params['id']})
+    m = mandrill.Mandrill('key', hedge_delay=5.0, pool_maxsize=1)
+    assert m.messages.info('abc') == {'_id': 'abc'}
+    assert m.last_request['url'] == 'messages/info' and 'abc' in m.last_request['request_body']
+    assert [m.hedge_pool.submit(lambda: m.last_request).result() for i in range(4)] == [None] * 4 # the workers keep nothing
+    m.users.ping()
+    api.routes['messages/info'] = lambda params: None
+    with pytest.raises(requests.ConnectionError):
+        m.messages.info('def')
+    assert m.last_request['url'] == 'users/ping'
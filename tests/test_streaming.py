@@ -0,0 +1,96 @@
+import base64, io, json, mmap, os, tempfile
+import pytest
+import mandrill
+
+TEXTS = ['plain text\r\n  with spaces ', 'päivää ☃', '😀', 'a😀bé😀 "\\/\t', 'x' * 1000 + '😀' * 100]
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def parse(result, size, binary_flag=False, ensure_ascii=True, opener=None):
+    body = json.dumps(result, ensure_ascii=ensure_ascii).encode('utf-8')
+    return mandrill.StreamingResultParser(chunked(body, size), opener, binary_flag).parse()
+
+def content(attachment):
+    return attachment['content'].file.read()
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 11, 64, 4096])
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_text_attachments(size, ensure_ascii):
+    result = {'attachments': [{'name': 'file%d.txt' % i, 'type': 'text/plain', 'binary': False, 'content': text} for i, text in enumerate(TEXTS)]}
+    parsed = parse(result, size, binary_flag=True, ensure_ascii=ensure_ascii)
+    assert [content(attachment).decode('utf-8') for attachment in parsed['attachments']] == TEXTS
+    assert [attachment['content'].name for attachment in parsed['attachments']] == ['file%d.txt' % i for i in range(len(TEXTS))]
+
+@pytest.mark.parametrize('size', [1, 3, 4, 7, 64])
+def test_binary_attachments_and_images(size):
+    blobs = [b'', b'x', b'xy', os.urandom(1000)]
+    result = {
+        'subject': 'Hello ☃', 'to': [{'email': 'a@example.com'}], 'tags': [], 'headers': {'X-Id': 1, 'X-Null': None, 'X-Flag': True},
+        'attachments': [{'name': 'blob%d' % i, 'type': 'application/octet-stream', 'content': base64.b64encode(blob).decode('ascii')} for i, blob in enumerate(blobs)],
+        'images': [{'name': 'logo.png', 'type': 'image/png', 'content': base64.encodebytes(blobs[-1]).decode('ascii')}],
+    }
+    parsed = parse(result, size)
+    assert [content(attachment) for attachment in parsed['attachments']] == blobs
+    assert content(parsed['images'][0]) == blobs[-1]
+    assert parsed['images'][0]['content'].kind == 'images' and parsed['attachments'][2]['content'].index == 2
+    assert (parsed['subject'], parsed['to'], parsed['tags'], parsed['headers']) == (result['subject'], result['to'], [], result['headers'])
+
+@pytest.mark.parametrize('size', [999, 5000, 65536])
+def test_binary_flag_after_the_content(size):
+    blob = os.urandom(300000)
+    result = {'attachments': [
+        {'content': base64.b64encode(blob).decode('ascii'), 'name': 'late.bin', 'binary': True},
+        {'content': 'päivää 😀', 'name': 'late.txt', 'binary': False},
+    ]}
+    parsed = parse(result, size, binary_flag=True)
+    assert content(parsed['attachments'][0]) == blob
+    assert content(parsed['attachments'][1]).decode('utf-8') == 'päivää 😀'
+
+def test_opener_gets_kind_and_index():
+    opened = []
+    def opener(kind, index):
+        opened.append((kind, index))
+        return io.BytesIO()
+    parse({'attachments': [{'content': 'YQ=='}, {'content': 'Yg=='}], 'images': [{'content': 'Yw=='}]}, 1, opener=opener)
+    assert opened == [('attachments', 0), ('attachments', 1), ('images', 0)]
+
+@pytest.mark.parametrize('body', [b'{"attachments": [{"content": "YW', b'{"attachments": [{"content": "YWJj"}', b'{"a": 1} x',
+                                  b'{"attachments": [{"binary": true, "content": "YWJ"}]}', b'{"attachments": [{"binary": false, "content": "\xc3"}]}'])
+def test_invalid_responses(body):
+    with pytest.raises(mandrill.Error):
+        mandrill.StreamingResultParser(chunked(body, 1), binary_flag=True).parse()
+
+def test_content_stream(api):
+    blob = os.urandom(500000)
+    api.routes['messages/content'] = lambda params: (200, {'_id': params['id'], 'text': 'Hi', 'attachments': [{'name': 'a.bin', 'type': 'application/octet-stream', 'content': base64.b64encode(blob).decode('ascii')}]})
+    api.routes['messages/parse'] = lambda params: (200, {'subject': 'Hi', 'attachments': [{'name': 'a.txt', 'type': 'text/plain', 'binary': False, 'content': params['raw_message']}]})
+    m = mandrill.Mandrill('key')
+    result = m.messages.content_stream('abc')
+    assert result['_id'] == 'abc' and content(result['attachments'][0]) == blob
+    assert content(m.messages.parse_stream('päivää 😀')['attachments'][0]).decode('utf-8') == 'päivää 😀'
+
+def test_streamed_attachments_are_sent_base64_encoded(api):
+    api.routes['messages/send'] = lambda params: (200, [{'email': 'a@example.com', 'status': 'sent', 'attachments': params['message']['attachments']}])
+    blob = os.urandom(mandrill.Attachment.CHUNK_SIZE * 2 + 5)
+    with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+        f.write(blob)
+        f.flush()
+        with open(f.name, 'rb') as source:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            attachments = [mandrill.Attachment(f.name), mandrill.Attachment(blob, 'bytes.bin'), mandrill.Attachment(mapped, 'mapped.bin'), mandrill.Attachment(io.BytesIO(blob), 'file.bin')]
+            m = mandrill.Mandrill('key')
+            sent = m.messages.send({'to': [{'email': 'a@example.com'}], 'attachments': attachments})[0]['attachments']
+            mapped.close()
+    assert [attachment['name'] for attachment in sent] == [os.path.basename(f.name), 'bytes.bin', 'mapped.bin', 'file.bin']
+    assert all(base64.b64decode(attachment['content']) == blob for attachment in sent)
+    assert 'mandrill-attachment-' in m.last_request['request_body']
+
+def test_streamed_contents_follow_the_key_order_of_the_message():
+    message = {'images': [mandrill.Attachment(b'BBBB', 'b.png', 'image/png')], 'attachments': [mandrill.Attachment(b'AAAA', 'a.bin'), mandrill.Attachment(b'CC', 'c.bin')]}
+    body = mandrill.encode_streaming(mandrill.DEFAULT_CODEC, {'key': 'key', 'message': message})
+    data = b''.join(body)
+    assert len(body) == len(data)
+    sent = json.loads(data)['message']
+    assert [base64.b64decode(image['content']) for image in sent['images']] == [b'BBBB']
+    assert [base64.b64decode(attachment['content']) for attachment in sent['attachments']] == [b'AAAA', b'CC']
@@ -0,0 +1,84 @@
+import asyncio, time
+import pytest
+import mandrill
+
+# (code, template_content, merge_vars, merge_language, html as rendered by templates/render)
+CASES = [
+    ('<div mc:edit="header">Default</div><p>Body</p>', [{'name': 'header', 'content': '<h1>Hi</h1>'}], None, 'mailchimp',
+     '<div mc:edit="header"><h1>Hi</h1></div><p>Body</p>'),
+    ("<td mc:edit='main'><table><td>x</td></table></td><td mc:edit='side'>keep</td>", [{'name': 'main', 'content': 'new'}], None, 'mailchimp',
+     "<td mc:edit='main'>new</td><td mc:edit='side'>keep</td>"),
+    ('<div mc:edit="unclosed">', [{'name': 'unclosed', 'content': 'x'}], None, 'mailchimp', '<div mc:edit="unclosed">'),
+    ('<div mc:edit="greeting">Hi</div>', [{'name': 'greeting', 'content': 'Hello *|FNAME|*'}], [{'name': 'fname', 'content': 'Ann'}], 'mailchimp',
+     '<div mc:edit="greeting">Hello Ann</div>'),
+    ('*|FNAME|* *|fname|* *| LNAME |*!', None, [{'name': 'FName', 'content': 'Ann'}, {'name': 'lname', 'content': 'Lee'}], 'mailchimp', 'Ann Ann Lee!'),
+    ('Hi *|FNAME|*, *|MISSING|*.', None, [{'name': 'fname', 'content': None}], 'mailchimp', 'Hi , .'),
+    ('*|IF:FNAME|*Hi *|FNAME|**|END:IF|*', None, [{'name': 'fname', 'content': '<Ann>'}], 'mailchimp', '*|IF:FNAME|*Hi <Ann>*|END:IF|*'),
+    ('*|COUNT|* items', None, [{'name': 'count', 'content': 3}], 'mailchimp', '3 items'),
+    ('{{name}} {{{name}}} {{ name }}', None, [{'name': 'name', 'content': '<b>Ann</b>'}], 'handlebars',
+     '&lt;b&gt;Ann&lt;/b&gt; <b>Ann</b> &lt;b&gt;Ann&lt;/b&gt;'),
+    ('{{user.name}} {{user.missing}} {{missing.name}} {{none}}', None, [{'name': 'user', 'content': {'name': 'Ann'}}, {'name': 'none', 'content': None}], 'handlebars', 'Ann   '),
+    ('{{#if vip}}Dear {{name}}{{else}}Hello{{/if}}', None, [{'name': 'name', 'content': 'Ann'}], 'handlebars', '{{#if vip}}Dear Ann{{else}}Hello{{/if}}'),
+    ('{{#each items}}{{this}} {{this.price}} {{@index}}{{/each}}', None, [], 'handlebars', '{{#each items}}{{this}} {{this.price}} {{@index}}{{/each}}'),
+    ('{{upper name}} {{else_value}} {{thistle}}', None, [{'name': 'else_value', 'content': 'x'}, {'name': 'thistle', 'content': 'y'}], 'handlebars', '{{upper name}} x y'),
+    ('*|FNAME|* {{name}}', None, None, 'mailchimp', '*|FNAME|* {{name}}'),
+]
+
+@pytest.mark.parametrize('code,template_content,merge_vars,merge_language,html', CASES)
+def test_render_template(code, template_content, merge_vars, merge_language, html):
+    assert mandrill.render_template(code, template_content, merge_vars, merge_language) == html
+
+@pytest.mark.parametrize('code,template_content,merge_vars,merge_language,html', CASES)
+def test_render_local(code, template_content, merge_vars, merge_language, html):
+    m = mandrill.Mandrill('key')
+    assert m.templates.render_local('any', template_content, merge_vars, merge_language, code=code) == {'html': html}
+
+def test_render_local_fetches_the_published_code(api):
+    api.routes['templates/info'] = lambda params: (200, {'name': params['name'], 'code': 'draft *|FNAME|*', 'publish_code': 'Hi *|FNAME|*'})
+    m = mandrill.Mandrill('key')
+    assert m.templates.render_local('welcome', [], [{'name': 'fname', 'content': 'Ann'}]) == {'html': 'Hi Ann'}
+
+def test_async_render_local_is_awaitable_either_way(api):
+    api.routes['templates/info'] = lambda params: (200, {'name': params['name'], 'code': 'Hi *|FNAME|*', 'publish_code': None})
+    async def main():
+        async with mandrill.AsyncMandrill('key') as m:
+            merge_vars = [{'name': 'fname', 'content': 'Ann'}]
+            return await m.templates.render_local('welcome', [], merge_vars), await m.templates.render_local('any', [], merge_vars, code='Bye *|FNAME|*')
+    assert asyncio.run(main()) == ({'html': 'Hi Ann'}, {'html': 'Bye Ann'})
+
+def test_render_message_and_personalize():
+    template = mandrill.compile_template('Hi *|FNAME|* from *|COMPANY|*')
+    message = {
+        'to': [{'email': 'ann@example.com'}, {'email': 'Bob@Example.com'}, {'email': 'cy@example.com'}],
+        'global_merge_vars': [{'name': 'company', 'content': 'Acme'}, {'name': 'fname', 'content': 'there'}],
+        'merge_vars': [{'rcpt': 'ann@example.com', 'vars': [{'name': 'fname', 'content': 'Ann'}]},
+                       {'rcpt': 'bob@example.com', 'vars': [{'name': 'FNAME', 'content': 'Bob'}, {'name': 'company', 'content': 'Bobco'}]}],
+        'recipient_metadata': [{'rcpt': 'cy@example.com', 'values': {'id': 3}}],
+    }
+    assert list(template.render_message(message)) == [
+        ('ann@example.com', 'Hi Ann from Acme'), ('Bob@Example.com', 'Hi Bob from Bobco'), ('cy@example.com', 'Hi there from Acme')]
+    personal = list(template.personalize(message))
+    assert [p['to'] for p in personal] == [[recipient] for recipient in message['to']]
+    assert [p['html'] for p in personal] == ['Hi Ann from Acme', 'Hi Bob from Bobco', 'Hi there from Acme']
+    assert personal[1]['merge_vars'] == [message['merge_vars'][1]]
+    assert personal[2]['merge_vars'] == [] and personal[2]['recipient_metadata'] == message['recipient_metadata']
+
+def test_compile_template_is_cached():
+    assert mandrill.compile_template('Hi *|FNAME|*') is mandrill.compile_template('Hi *|FNAME|*')
+    assert mandrill.compile_template('Hi {{name}}', 'handlebars') is not mandrill.compile_template('Hi {{name}}')
+
+def test_render_10k_recipients_benchmark():
+    code = '<div mc:edit="header">Default</div>' + '<p>Dear *|FNAME|*, your order *|ORDER|* from *|COMPANY|* ships on *|DATE|*.</p>' * 20
+    recipients = 10000
+    message = {
+        'to': [{'email': 'user%d@example.com' % i} for i in range(recipients)],
+        'global_merge_vars': [{'name': 'company', 'content': 'Acme'}, {'name': 'date', 'content': '2026-10-16'}],
+        'merge_vars': [{'rcpt': 'user%d@example.com' % i, 'vars': [{'name': 'fname', 'content': 'User %d' % i}, {'name': 'order', 'content': i}]} for i in range(recipients)],
+    }
+    start = time.perf_counter()
+    rendered = list(mandrill.compile_template(code).render_message(message))
+    elapsed = time.perf_counter() - start
+    print('rendered %d recipients in %.3fs (%.1fus each)' % (recipients, elapsed, elapsed / recipients * 1e6))
+    assert len(rendered) == recipients
+    assert rendered[-1] == ('user9999@example.com', '<div mc:edit="header">Default</div>' + '<p>Dear User 9999, your order 9999 from Acme ships on 2026-10-16.</p>' * 20)
+    assert elapsed < 10 # about 0.4s here, the 10k templates/render calls it stands for take minutes
@@ -0,0 +1,47 @@
+import json, threading
+import mandrill
+
+THREADS = 32
+CALLS = 50
+
+def test_shared_client_keeps_last_request_per_thread(api):
+    api.routes['tags/info'] = lambda params: (200, {'tag': params['tag'], 'sent': len(params['tag'])})
+    m = mandrill.Mandrill('key', pool_maxsize=THREADS)
+    barrier = threading.Barrier(THREADS)
+    mismatches, errors = [], []
+
+    def hammer(thread):
+        try:
+            barrier.wait()
+            for i in range(CALLS):
+                tag = 'thread-%d-call-%d' % (thread, i)
+                result = m.tags.info(tag)
+                last_request = m.last_request
+                if (result['tag'] != tag or last_request['url'] != 'tags/info'
+                        or json.loads(last_request['request_body'])['tag'] != tag
+                        or json.loads(last_request['response_body'])['tag'] != tag):
+                    mismatches.append((tag, result, last_request['request_body'], last_request['response_body']))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=hammer, args=(thread,)) for thread in range(THREADS)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert errors == []
+    assert mismatches == []
+    assert len(api.calls) == THREADS * CALLS
+
+def test_last_request_is_not_shared_between_threads(api):
+    m = mandrill.Mandrill('key')
+    m.users.ping()
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(m.last_request))
+    thread.start()
+    thread.join()
+    assert seen == [None]
+    assert m.last_request['url'] == 'users/ping'
+
+def test_warm_up_opens_concurrent_connections(api):
+    m = mandrill.Mandrill('key', pool_maxsize=8)
+    assert m.warm_up() == ['PONG!'] * 8
+    assert api.urls() == ['users/ping'] * 8